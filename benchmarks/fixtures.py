@@ -0,0 +1,165 @@
+import os
+import re
+import json
+import math
+import random
+import asyncio
+import argparse
+import aiohttp
+from datetime import date, timedelta
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+LIVE_API_URL = "https://ranobedb.org/api/v0"
+
+# Queries the stand-in knows how many results to return for, when there is no recorded fixture
+SEARCH_COUNTS = {
+    "single": 1,
+    "small": 35,
+    "medium": 450,
+    "large": 5000
+}
+DEFAULT_SEARCH_COUNT = 235
+
+
+####### Recorded Fixtures #######
+
+def slug(text):
+    return re.sub(r"[^a-z0-9]+", "-", text.casefold()).strip("-") or "empty"
+
+def search_fixture_path(query, page):
+    return os.path.join(FIXTURES_DIR, f"search_{slug(query)}_p{page}.json")
+
+def series_fixture_path(series_id):
+    return os.path.join(FIXTURES_DIR, f"series_{series_id}.json")
+
+def load_fixture(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+async def record(queries, series_ids, max_pages=3):
+    # Saves real API responses so the stand-in can replay them
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    async with aiohttp.ClientSession(raise_for_status=True) as session:
+        for query in queries:
+            total_pages = 1
+            page = 1
+            while page <= min(total_pages, max_pages):
+                params = {"q": query, "sort": "Relevance desc", "limit": 100, "page": page}
+                async with session.get(f"{LIVE_API_URL}/series", params=params) as resp:
+                    data = await resp.json()
+                total_pages = data["totalPages"]
+                with open(search_fixture_path(query, page), "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False)
+                print(f"Recorded search '{query}' page {page}/{total_pages}")
+                page += 1
+                await asyncio.sleep(0.5)
+        for series_id in series_ids:
+            async with session.get(f"{LIVE_API_URL}/series/{series_id}") as resp:
+                data = await resp.json()
+            with open(series_fixture_path(series_id), "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            print(f"Recorded series {series_id} ({len(data['series'].get('books', []))} volumes)")
+            await asyncio.sleep(0.5)
+
+
+####### Synthetic Fixtures #######
+# Shaped like the RanobeDB responses, for when nothing was recorded
+
+def volume_count(series_id):
+    # The series id decides how many volumes a synthetic series has, e.g. 1060 -> 60 volumes
+    return series_id % 1000 or 12
+
+def api_date(d):
+    return d.year * 10000 + d.month * 100 + d.day
+
+def synthetic_book(series_id, n, licensed):
+    jp_date = date(2010, 1, 10) + timedelta(days=int(n * 120 + (series_id % 7) * 3))
+    en_date = jp_date + timedelta(days=540)
+    return {
+        "id": series_id * 1000 + n,
+        "lang": "en" if licensed else "ja",
+        "title": f"Synthetic Series {series_id}, Vol. {n}",
+        "title_orig": f"合成シリーズ{series_id} {n}",
+        "romaji": f"Gousei Shiriizu {series_id} {n}",
+        "romaji_orig": f"Gousei Shiriizu {series_id} {n}",
+        "sort_order": n,
+        "c_release_dates": {"ja": api_date(jp_date), "en": api_date(en_date)},
+        "image": {"filename": f"synthetic/{series_id}_{n}.jpg"}
+    }
+
+def synthetic_series(series_id):
+    total = volume_count(series_id)
+    licensed = series_id % 2 == 0
+    translated = total * 2 // 3 if licensed else 0
+    return {
+        "series": {
+            "id": series_id,
+            "title": f"Synthetic Series {series_id}",
+            "title_orig": f"合成シリーズ{series_id}",
+            "romaji": f"Gousei Shiriizu {series_id}",
+            "romaji_orig": f"Gousei Shiriizu {series_id}",
+            "lang": "en" if licensed else "ja",
+            "publication_status": "ongoing" if series_id % 3 else "completed",
+            "start_date": synthetic_book(series_id, 1, False)["c_release_dates"]["ja"],
+            "bookwalker_id": series_id,
+            "book_description": {"description": "A synthetic series. " * 20, "description_ja": "合成されたシリーズ。" * 20},
+            "books": [synthetic_book(series_id, n, n <= translated) for n in range(1, total + 1)],
+            "staff": [
+                {"name": "作者", "romaji": "Sakusha", "role_type": "author"},
+                {"name": "絵師", "romaji": None, "role_type": "artist"}
+            ],
+            "publishers": [
+                {"name": "Synthetic Bunko", "publisher_type": "imprint", "lang": "ja"},
+                {"name": "Synthetic Press", "publisher_type": "publisher", "lang": "en"}
+            ],
+            "tags": [{"name": "fantasy"}, {"name": "isekai"}, {"name": "romance"}]
+        }
+    }
+
+TITLE_WORDS = (
+    "my", "hero", "academia", "the", "of", "a", "in", "another", "world", "reincarnated", "as", "slime",
+    "tensei", "shitara", "datta", "ken", "isekai", "sword", "magic", "demon", "lord", "princess", "villainess",
+    "academy", "kingdom", "dragon", "hero's", "party", "kicked", "out", "level", "skill", "cheat", "life",
+    "no", "wa", "ga", "to", "ni", "kara", "saikyou", "maou", "yuusha", "ore", "boku", "kanojo", "love", "comedy",
+    "romantic", "girlfriend", "school", "days", "chronicle", "record", "tale", "saga", "overlord", "sage", "witch"
+)
+
+def synthetic_titles(n, seed=1):
+    # Title index items made of common light novel words, so fuzzy lookups share plenty of trigrams
+    rng = random.Random(seed)
+    items = []
+    for i in range(n):
+        title = " ".join(rng.choice(TITLE_WORDS) for _ in range(rng.randint(2, 8)))
+        romaji = " ".join(rng.choice(TITLE_WORDS) for _ in range(rng.randint(2, 8)))
+        items.append({"id": 100000 + i, "lang": "en" if i % 2 else "ja", "title": title.title(), "romaji": romaji, "romaji_orig": romaji})
+    return items
+
+def synthetic_search(query, page, limit=100):
+    count = SEARCH_COUNTS.get(query.casefold(), DEFAULT_SEARCH_COUNT)
+    start = (page - 1) * limit
+    items = []
+    for i in range(start, min(start + limit, count)):
+        series_id = 1000 * (i + 1) + 20
+        items.append({
+            "id": series_id,
+            "lang": "en" if i % 2 else "ja",
+            "title": f"{query} result {i + 1}",
+            "title_orig": f"{query} 結果 {i + 1}",
+            "romaji": f"{query} kekka {i + 1}",
+            "romaji_orig": f"{query} kekka {i + 1}"
+        })
+    return {"count": str(count), "totalPages": max(1, math.ceil(count / limit)), "series": items}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record RanobeDB responses as benchmark fixtures")
+    parser.add_argument("--query", action="append", default=[], help="search query to record (repeatable)")
+    parser.add_argument("--series", action="append", type=int, default=[], help="series id to record (repeatable)")
+    parser.add_argument("--max-pages", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(record(args.query, args.series, args.max_pages))
+
+if __name__ == "__main__":
+    main()
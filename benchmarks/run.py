@@ -0,0 +1,239 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import resource
+import subprocess
+import tracemalloc
+from benchmarks.fixtures import synthetic_series, synthetic_search, synthetic_titles
+from benchmarks.stand_in import StandInConfig, start_stand_in
+
+# The bot modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+####### Stats #######
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[k]
+
+def summarize(name, latencies, wall_time, peak_bytes):
+    latencies = sorted(latencies)
+    return {
+        "name": name,
+        "iterations": len(latencies),
+        "mean_ms": sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "throughput_per_s": len(latencies) / wall_time if wall_time else 0.0,
+        "peak_mem_kb": peak_bytes / 1024
+    }
+
+async def measure(name, call, iterations, warmup=2, concurrency=1):
+    # `call` returns a coroutine. Timing and memory are measured in separate passes,
+    # since tracemalloc slows everything down
+    for _ in range(warmup):
+        await call()
+    latencies = []
+
+    async def timed():
+        start = time.perf_counter()
+        await call()
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    if concurrency <= 1:
+        for _ in range(iterations):
+            await timed()
+    else:
+        semaphore = asyncio.Semaphore(concurrency)
+        async def bounded():
+            async with semaphore:
+                await timed()
+        await asyncio.gather(*(bounded() for _ in range(iterations)))
+    wall_time = time.perf_counter() - start
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    for _ in range(min(3, iterations)):
+        await call()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result = summarize(name, latencies, wall_time, peak)
+    print(format_row(result), flush=True)
+    return result
+
+
+####### Report #######
+
+HEADER = f"{'benchmark':<44}{'n':>6}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}{'ops/s':>11}{'peak KB':>11}"
+
+def format_row(r):
+    return (f"{r['name']:<44}{r['iterations']:>6}{r['p50_ms']:>11.2f}{r['p95_ms']:>11.2f}"
+            f"{r['p99_ms']:>11.2f}{r['throughput_per_s']:>11.1f}{r['peak_mem_kb']:>11.1f}")
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(base_path, new_path):
+    with open(base_path, encoding="utf-8") as f:
+        base = {r["name"]: r for r in json.load(f)["results"]}
+    with open(new_path, encoding="utf-8") as f:
+        new = {r["name"]: r for r in json.load(f)["results"]}
+    print(f"{'benchmark':<44}{'p50':>18}{'p95':>18}{'p99':>18}{'ops/s':>18}{'peak KB':>18}")
+    for name, r in new.items():
+        b = base.get(name)
+        if b is None:
+            print(f"{name:<44}{'(new)':>18}")
+            continue
+        cells = []
+        for key in ("p50_ms", "p95_ms", "p99_ms", "throughput_per_s", "peak_mem_kb"):
+            change = (r[key] - b[key]) / b[key] * 100 if b[key] else 0.0
+            cells.append(f"{r[key]:.1f} ({change:+.0f}%)")
+        print(f"{name:<44}" + "".join(f"{c:>18}" for c in cells))
+    for name in base.keys() - new.keys():
+        print(f"{name:<44}{'(removed)':>18}")
+
+
+####### Benchmarks #######
+
+def configure_env(api_url):
+    # Point the bot at the stand-in and take the persistent/background parts out of the picture
+    os.environ["RANOBEDB_API_URL"] = api_url
+    os.environ.setdefault("CACHE_DB_PATH", "")
+    os.environ.setdefault("TITLE_INDEX_ENABLED", "0")
+    os.environ.setdefault("RANOBEDB_RATE_LIMIT", "100000")
+    os.environ.setdefault("RANOBEDB_RATE_BURST", "100000")
+    os.environ.setdefault("RANOBEDB_BACKOFF_BASE", "0.01")
+
+async def run_benchmarks(args):
+    config = StandInConfig(args.latency, args.jitter, args.error_rate, args.throttle_rate, seed=args.seed)
+    runner, api_url = await start_stand_in(config)
+    configure_env(api_url)
+    import bot_utils
+    import http_client
+    from bot_ext import create_results_page
+    from loop_watchdog import start_watchdog
+    watchdog = start_watchdog(threshold=args.watchdog_threshold) if args.watchdog else None
+
+    def clear_caches():
+        bot_utils.series_cache.clear()
+        bot_utils.search_cache.clear()
+
+    async def search(query, lazy=True):
+        clear_caches()
+        bot_utils.LAZY_SEARCH_RESULTS = lazy
+        return await bot_utils.search_series(query, "Relevance desc", "Both")
+
+    async def series_info(series_id):
+        clear_caches()
+        return await bot_utils.fetch_series_info(series_id)
+
+    def sync(fn, *fn_args):
+        async def call():
+            return fn(*fn_args)
+        return call
+
+    n = args.iterations
+    results = []
+    print(HEADER)
+    for query in ("single", "small", "medium", "large"):
+        results.append(await measure(f"search_series[{query}]", lambda q=query: search(q), n, concurrency=args.concurrency))
+    results.append(await measure("search_series[large, eager]", lambda: search("large", lazy=False), max(1, n // 5), concurrency=args.concurrency))
+    for series_id in (1005, 1020, 1060, 1120):
+        results.append(await measure(f"fetch_series_info[{series_id % 1000} vols]", lambda s=series_id: series_info(s), n, concurrency=args.concurrency))
+
+    for series_id in (1005, 1060, 1120):
+        data = synthetic_series(series_id)
+        results.append(await measure(f"Series.from_json[{series_id % 1000} vols]", sync(bot_utils.Series.from_json, data), n * 5))
+        results.append(await measure(f"build_series_info[{series_id % 1000} vols]", sync(bot_utils.build_series_info, data), n * 5))
+
+    flat = [item for page in range(1, 51) for item in bot_utils.parse_search_items(synthetic_search("large", page))]
+    results.append(await measure("paginate_results[5000]", sync(bot_utils.paginate_results, flat), n))
+    paged = bot_utils.paginate_results(flat)
+    results.append(await measure("create_results_page[500 pages]", sync(create_results_page, len(flat), paged), max(1, n // 5)))
+
+    # Autocomplete lookups against the local title index: typos and partial words fall through to the fuzzy search
+    from title_index import TitleIndex
+    index = TitleIndex()
+    index.add_many(synthetic_titles(20000))
+    results.append(await measure("title_index[prefix, 20k]", sync(index.search, "my hero"), n * 5))
+    for query in ("tensei shitara slime", "vilainess acadmy", "overlrd"):
+        results.append(await measure(f"title_index[fuzzy, 20k, {query}]", sync(index.search, query), n * 5))
+
+    if not args.skip_graph:
+        graph_args = bot_utils.build_series_info(synthetic_series(1060))[1:]
+        try:
+            import graph
+            from render_pool import OUTPUT_PROFILES
+            for engine in ("classic", "template"):
+                for profile_name in ("print", "standard", "compact"):
+                    profile = OUTPUT_PROFILES[profile_name]
+                    size = len(graph.render(graph_args, engine, profile).getvalue())
+                    results.append(await measure(f"graph[{engine}, {profile_name}, {size // 1024} KB]",
+                                                 sync(graph.render, graph_args, engine, profile), args.graph_iterations, warmup=1))
+        except OSError as e:
+            print(f"Skipping generate_graph: {e} (the ./fonts directory is needed)")
+
+    await http_client.close_session()
+    await runner.cleanup()
+    loop_report = None
+    if watchdog is not None:
+        watchdog.stop()
+        loop_report = {**watchdog.stats(), "lag": watchdog.lag.summary(), "call_sites": watchdog.top_call_sites()}
+        print(f"Event loop stalls: {watchdog.stalls}, max blocked {watchdog.max_blocked * 1000:.0f}ms")
+        for site, count in watchdog.top_call_sites():
+            print(f"  {count:>4}x {site}")
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "args": vars(args),
+            "stand_in": {"requests": config.requests, "errors": config.errors, "throttled": config.throttled},
+            "http_counters": dict(http_client.counters),
+            "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "event_loop": loop_report
+        },
+        "results": results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline Ranobot benchmarks against a local RanobeDB stand-in")
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--graph-iterations", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=1, help="concurrent calls for the API benchmarks")
+    parser.add_argument("--latency", type=float, default=0.02, help="stand-in latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.01, help="stand-in latency jitter in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of stand-in responses that are 503s")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of stand-in responses that are 429s")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--skip-graph", action="store_true")
+    parser.add_argument("--watchdog", action="store_true", help="report event loop stalls during the run")
+    parser.add_argument("--watchdog-threshold", type=float, default=0.1, help="seconds")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    report = asyncio.run(run_benchmarks(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import random
+import asyncio
+import argparse
+from aiohttp import web
+from benchmarks.fixtures import load_fixture, search_fixture_path, series_fixture_path, synthetic_search, synthetic_series
+
+
+class StandInConfig:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0, seed=None):
+        self.latency = latency              # seconds added to every response
+        self.jitter = jitter                # up to this many extra seconds
+        self.error_rate = error_rate        # fraction of requests answered with a 503
+        self.throttle_rate = throttle_rate  # fraction of requests answered with a 429
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+
+
+async def _delay_or_fail(config):
+    config.requests += 1
+    if config.latency or config.jitter:
+        await asyncio.sleep(config.latency + config.random.uniform(0, config.jitter))
+    roll = config.random.random()
+    if roll < config.throttle_rate:
+        config.throttled += 1
+        return web.json_response({"message": "Too many requests"}, status=429, headers={"Retry-After": "0"})
+    if roll < config.throttle_rate + config.error_rate:
+        config.errors += 1
+        return web.json_response({"message": "Injected error"}, status=503)
+    return None
+
+async def search(request):
+    config = request.app["config"]
+    failure = await _delay_or_fail(config)
+    if failure is not None:
+        return failure
+    query = request.query.get("q", "")
+    page = int(request.query.get("page", 1))
+    data = load_fixture(search_fixture_path(query, page)) or synthetic_search(query, page, int(request.query.get("limit", 100)))
+    return web.json_response(data)
+
+async def series_detail(request):
+    config = request.app["config"]
+    failure = await _delay_or_fail(config)
+    if failure is not None:
+        return failure
+    series_id = int(request.match_info["series_id"])
+    return web.json_response(load_fixture(series_fixture_path(series_id)) or synthetic_series(series_id))
+
+def create_app(config=None):
+    app = web.Application()
+    app["config"] = config or StandInConfig()
+    app.router.add_get("/api/v0/series", search)
+    app.router.add_get("/api/v0/series/{series_id}", series_detail)
+    return app
+
+async def start_stand_in(config=None, host="127.0.0.1", port=0):
+    # Returns the runner (for cleanup) and the API base url to point RANOBEDB_API_URL at
+    runner = web.AppRunner(create_app(config), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}/api/v0"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the RanobeDB API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8085)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    config = StandInConfig(args.latency, args.jitter, args.error_rate, args.throttle_rate)
+    print(f"Serving the RanobeDB stand-in on http://{args.host}:{args.port}/api/v0")
+    web.run_app(create_app(config), host=args.host, port=args.port, print=None)
+
+if __name__ == "__main__":
+    main()
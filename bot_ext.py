@@ -1,8 +1,10 @@
 import discord
 from discord.ui import Select, View
-from discord.ext.pages import Page
-from bot_utils import fetch_series_info, create_embed
-from graph import generate_graph
+from discord.ext.pages import Page, Paginator
+from bot_utils import fetch_series_info, create_embed, AUTOCOMPLETE_ID_PREFIX
+from render_pool import render_graph, speculate, cancel_speculation, RendererBusy, RenderTimeout, GRAPH_FILENAME
+from title_index import title_index
+from metrics import span
 import logging
 
 logger = logging.getLogger(__name__)
@@ -11,7 +13,7 @@ logger = logging.getLogger(__name__)
 ### Custom View and Selector Classes ###
 
 class GraphButtonView(discord.ui.View):
-    def __init__(self, vol_rel_dates_jp, vol_rel_dates_en, predict, title, latest_vol_jp, latest_vol_en):
+    def __init__(self, vol_rel_dates_jp, vol_rel_dates_en, predict, title, latest_vol_jp, latest_vol_en, stats=None):
         super().__init__()
         self.vol_rel_dates_jp = vol_rel_dates_jp
         self.vol_rel_dates_en = vol_rel_dates_en
@@ -19,6 +21,14 @@ class GraphButtonView(discord.ui.View):
         self.title = title
         self.latest_vol_jp = latest_vol_jp
         self.latest_vol_en = latest_vol_en
+        self.stats = stats
+        self.speculation_key = speculate(vol_rel_dates_jp, vol_rel_dates_en, predict, title, latest_vol_jp, latest_vol_en, stats)
+
+    async def on_timeout(self):
+        if self.speculation_key is not None:
+            cancel_speculation(self.speculation_key)
+        await super().on_timeout()
+
     @discord.ui.button(label="Published Volume Graph", style=discord.ButtonStyle.secondary, emoji="📈")
     async def button_callback(self, button, interaction):
         try:
@@ -28,11 +38,18 @@ class GraphButtonView(discord.ui.View):
                 button.disabled = True
                 await interaction.message.edit(view=self)
                 return
-            buf = generate_graph(self.vol_rel_dates_jp, self.vol_rel_dates_en, self.predict, self.title, self.latest_vol_jp, self.latest_vol_en)
-            file = discord.File(buf, filename="chart.png")
-            await interaction.followup.send(file=file)
+            buf = await render_graph(self.vol_rel_dates_jp, self.vol_rel_dates_en, self.predict, self.title, self.latest_vol_jp, self.latest_vol_en, self.stats)
+            file = discord.File(buf, filename=GRAPH_FILENAME)
+            with span("followup_send"):
+                await interaction.followup.send(file=file)
             button.disabled = True
             await interaction.message.edit(view=self)
+        except RendererBusy:
+            await interaction.followup.send("⏳ Too many graphs are being generated right now. Please try again in a bit.", ephemeral=True)
+            logger.warning(f"Graph renderer is saturated. Rejected graph for {self.title}")
+        except RenderTimeout:
+            await interaction.followup.send("⌛ The graph took too long to generate. Please try again later.", ephemeral=True)
+            logger.warning(f"Graph generation timed out for {self.title}")
         except Exception as e:
             await interaction.followup.send("🚨 An unexpected error occurred.", ephemeral=True)
             logger.error(f"Error during graph generation for {self.title}", exc_info=True)
@@ -62,9 +79,10 @@ class ResultsSelector(Select):
             selected_sn = int(self.values[0])
             ln_name = self.sn_dict[selected_sn]
             ln_id = self.results_dict[ln_name]
-            embed, vol_rel_dates_jp, vol_rel_dates_en, predict, title, latest_vol_jp, latest_vol_en = fetch_series_info(ln_id)
-            button_view = GraphButtonView(vol_rel_dates_jp, vol_rel_dates_en, predict, title, latest_vol_jp, latest_vol_en)
-            await interaction.message.edit(embed=embed, view=button_view)
+            embed, *graph_args = await fetch_series_info(ln_id)
+            button_view = GraphButtonView(*graph_args)
+            with span("followup_send"):
+                await interaction.message.edit(embed=embed, view=button_view)
         except discord.NotFound:
             await interaction.followup.send("❌ Message no longer exists. Please try searching again.", ephemeral=True)
         except discord.HTTPException as e:
@@ -81,24 +99,74 @@ class ResultsView(View):
         item = ResultsSelector(page, results_dict)
         self.add_item(item)
 
+class LazyResultsPaginator(Paginator):
+    # Paginator that only builds a results page (and fetches its API page) when it is first shown
+    def __init__(self, search_results, **kwargs):
+        self.search_results = search_results
+        super().__init__(pages=[None] * search_results.page_count, **kwargs)
+
+    async def load_page(self, page_number):
+        results_dict = await self.search_results.get_page(page_number + 1)
+        if self.pages[page_number] is None:
+            with span("create_results_page"):
+                self.pages[page_number] = create_result_page(self.search_results.count, page_number + 1, results_dict)
+
+    async def goto_page(self, page_number=0, *, interaction=None):
+        try:
+            if interaction is not None and not self.search_results.is_loaded(page_number + 1):
+                # Fetching the page can take longer than the interaction window, so acknowledge it first
+                await interaction.response.defer()
+                await self.load_page(page_number)
+                return await super().goto_page(page_number)
+            await self.load_page(page_number)
+        except Exception:
+            logger.error(f"Error while loading search results page {page_number + 1}", exc_info=True)
+            if interaction is not None:
+                # Cached pages fail before the interaction got acknowledged, and a followup needs it acknowledged
+                if interaction.response.is_done():
+                    await interaction.followup.send("🚨 An unexpected error occurred.", ephemeral=True)
+                else:
+                    await interaction.response.send_message("🚨 An unexpected error occurred.", ephemeral=True)
+            return
+        return await super().goto_page(page_number, interaction=interaction)
+
+    async def respond(self, interaction, *args, **kwargs):
+        await self.load_page(self.current_page)
+        return await super().respond(interaction, *args, **kwargs)
+
 ### ------------------------------------------------------------- ###
 
+async def title_autocomplete(ctx: discord.AutocompleteContext):
+    if len(ctx.value.strip()) < 2:
+        return []
+    # The choice values are series ids, so the command knows exactly which series was picked
+    licensed = ctx.options.get("license-filter") or "Both"
+    choices = {}
+    for entry in title_index.search(ctx.value, limit=25, licensed=licensed):
+        name = entry.display_name[:100]
+        if name not in choices:
+            choices[name] = discord.OptionChoice(name, f"{AUTOCOMPLETE_ID_PREFIX}{entry.id}")
+    return list(choices.values())
+
+def create_result_page(count, page_no, results_dict):
+    count_description = f"***Found {count} results***\n\n"
+    s_list = [f"{(10*(page_no-1)+i)}. {title}" for i, title in enumerate(results_dict, start=1)]
+    results_description = "\n".join(s_list)
+    description = count_description + results_description
+    return Page(
+        embeds=[
+            discord.Embed(
+                title="**Search Results**",
+                description=description,
+                color=0x2f0045
+            )
+        ],
+        custom_view=ResultsView(page_no, results_dict)
+    )
+
 def create_results_page(count, search_results):
     pages_list = []
-    for page_no, results_dict in search_results.items():
-        count_description = f"***Found {count} results***\n\n"
-        s_list = [f"{(10*(page_no-1)+i)}. {title}" for i, title in enumerate(results_dict, start=1)]
-        results_description = "\n".join(s_list)
-        description = count_description + results_description
-        page = Page(
-            embeds=[
-                discord.Embed(
-                    title="**Search Results**",
-                    description=description,
-                    color=0x2f0045
-                )
-            ],
-            custom_view=ResultsView(page_no, results_dict)
-        )
-        pages_list.append(page)
+    with span("create_results_page"):
+        for page_no, results_dict in search_results.items():
+            pages_list.append(create_result_page(count, page_no, results_dict))
     return pages_list
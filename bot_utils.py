@@ -1,39 +1,76 @@
-import requests
+import os
 import json
-import aiohttp
+import time
 import asyncio
 import math
 import logging
 from discord import Embed
 from dataclasses import dataclass, field
-from datetime import datetime, date
+from datetime import date
 from typing import List, Optional
+import fast_json
+from http_client import get_json
+from cache import TTLCache, Expiring
+from singleflight import SingleFlight
+from store import cache_store
+from title_index import title_index, TitleEntry, TITLE_INDEX_ENABLED
+from metrics import span, register_stats
+from popularity import series_popularity, query_popularity
+from release_dates import ReleaseDates
 
-SERIES_API_ENDPOINT = "https://ranobedb.org/api/v0/series"
-VOLUMES_API_ENDPOINT = "https://ranobedb.org/api/v0/books/"
+RANOBEDB_API_URL = os.getenv("RANOBEDB_API_URL", "https://ranobedb.org/api/v0").rstrip("/")
+SERIES_API_ENDPOINT = f"{RANOBEDB_API_URL}/series"
+VOLUMES_API_ENDPOINT = f"{RANOBEDB_API_URL}/books/"
 IMAGES_ENDPOINT = "https://images.ranobedb.org/"
 BOOKWALKER_ENDPOINT = "https://bookwalker.jp/series/"
 
+LAZY_SEARCH_RESULTS = os.getenv("LAZY_SEARCH_RESULTS", "1") == "1"
+AUTOCOMPLETE_ID_PREFIX = "id:"      # title autocomplete choice values are this followed by the series id
+SEARCH_CONCURRENCY = int(os.getenv("SEARCH_CONCURRENCY", "4"))               # API pages fetched at once per search
+SEARCH_PREFETCH_DISTANCE = int(os.getenv("SEARCH_PREFETCH_DISTANCE", "3"))    # in result pages (10 results each)
+SERIES_CACHE_TTL = float(os.getenv("SERIES_CACHE_TTL", "21600"))
+SERIES_CACHE_MAX_ENTRIES = int(os.getenv("SERIES_CACHE_MAX_ENTRIES", "2000"))
+SERIES_CACHE_MAX_MB = float(os.getenv("SERIES_CACHE_MAX_MB", "64"))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "3600"))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "2000"))
+TITLE_INDEX_REFRESH_INTERVAL = float(os.getenv("TITLE_INDEX_REFRESH_INTERVAL", "900"))
+TITLE_INDEX_PAGES_PER_REFRESH = int(os.getenv("TITLE_INDEX_PAGES_PER_REFRESH", "5"))
+
 logger = logging.getLogger(__name__)
 
+series_cache = TTLCache("series", ttl=SERIES_CACHE_TTL, max_entries=SERIES_CACHE_MAX_ENTRIES, max_bytes=int(SERIES_CACHE_MAX_MB * 1024 * 1024))
+series_flight = SingleFlight("series")
+search_cache = TTLCache("search", ttl=SEARCH_CACHE_TTL, max_entries=SEARCH_CACHE_MAX_ENTRIES)
+search_flight = SingleFlight("search")
+
+register_stats("cache", "series", series_cache.stats, counters=TTLCache.COUNTERS)
+register_stats("cache", "search", search_cache.stats, counters=TTLCache.COUNTERS)
+register_stats("singleflight", "series", series_flight.stats, counters=SingleFlight.COUNTERS)
+register_stats("singleflight", "search", search_flight.stats, counters=SingleFlight.COUNTERS)
+register_stats("title_index", "titles", lambda: {"entries": len(title_index), "complete": int(title_index.complete)})
+
 ####### Misc Functions 1 #######
 
+def decode_date(value):
+    # RanobeDB dates are YYYYMMDD integers, so this is much cheaper than going through strptime
+    year, month_day = divmod(int(value), 10000)
+    month, day = divmod(month_day, 100)
+    return date(year, month, day)
+
 def convert_to_date(date_str, vname_or_sid=None):
-    date_str = str(date_str)
     try:
-        d = datetime.strptime(date_str, "%Y%m%d").date()
-        return d
+        return decode_date(date_str)
     except ValueError:
+        date_str = str(date_str)
         if date_str[-2:] == "99":                   # Some volumes on the site have their release dates as 99
             date_str = date_str[:-2]+"25"           # This is just a quick workaround until the API fixed it
         logger.info(f"Series ID or Volume Name: [{vname_or_sid}] had incorrect date. Replaced with '25'")
-        d = datetime.strptime(date_str, "%Y%m%d").date()
-        return d
+        return decode_date(date_str)
 
 
 ######## Data Classes ########
 
-@dataclass
+@dataclass(slots=True)
 class Volume:
     id: int
     lang: str
@@ -59,7 +96,7 @@ class Volume:
             en_release_date=en_release_date
         )
 
-@dataclass
+@dataclass(slots=True)
 class Series:
     id: int
     title: str
@@ -79,17 +116,39 @@ class Series:
     lang: str
     tags: List[str]
     licensed: bool
-    volumes: List[Volume] = field(default_factory=list)
+    # The raw book json. Volumes are only parsed when something asks for them
+    books: list = field(default_factory=list, repr=False)
+
+    @property
+    def volumes(self) -> List[Volume]:
+        return [Volume.from_series_json(vol) for vol in self.books]
+
+    def release_dates(self):
+        # Straight from the book json into the compact form, without going through Volume objects
+        jp_ordinals = {}
+        en_ordinals = {}
+        latest_vol_jp = None
+        latest_vol_en = None
+        latest_release_en = None
+        for book in sorted(self.books, key=lambda b: b["sort_order"]):
+            release_dates = book["c_release_dates"]
+            jp_ordinals[book["sort_order"]] = convert_to_date(release_dates["ja"], book.get("title")).toordinal()
+            latest_vol_jp = book["title_orig"]
+            if book["lang"] == "en":
+                latest_release_en = convert_to_date(release_dates["en"], book.get("title"))
+                en_ordinals[book["sort_order"]] = latest_release_en.toordinal()
+                latest_vol_en = book["title"]
+        return ReleaseDates(jp_ordinals, jp_ordinals.values()), ReleaseDates(en_ordinals, en_ordinals.values()), latest_vol_jp, latest_vol_en, latest_release_en
 
     @classmethod
     def from_json(cls, data: dict) -> 'Series':
         series_data = data["series"]
-        volumes = [Volume.from_series_json(vol) for vol in series_data.get("books", [])]
+        books = series_data.get("books", [])
         staff = series_data.get('staff')
         publishers = series_data.get('publishers')
         tags = [tag["name"].capitalize() for tag in series_data.get("tags", [])]
         first_released = str(convert_to_date(series_data.get("start_date"),series_data.get("id"))) + " (JP)"
-        latest_released = str(volumes[-1].jp_release_date) + " (JP)"
+        latest_released = str(convert_to_date(books[-1]["c_release_dates"]["ja"], books[-1].get("title"))) + " (JP)"
         author = [f'{staff["name"]} ({staff["romaji"]})' if staff["romaji"] is not None else staff["name"] for staff in staff if staff["role_type"] == "author"]
         illustrator = [f'{staff["name"]} ({staff["romaji"]})' if staff["romaji"] is not None else staff["name"] for staff in staff if staff["role_type"] == "artist"]
         imprint_ja = [pub["name"] for pub in publishers if pub["publisher_type"] == "imprint" and pub["lang"] == "ja"]
@@ -99,7 +158,8 @@ class Series:
             desc = series_data.get("book_description", {}).get("description_ja")
         else:
             licensed = True
-            first_released = first_released + f'\n{volumes[0].en_release_date} (EN)'
+            first_en = convert_to_date(books[0]["c_release_dates"]["en"], books[0].get("title")) if books[0]["lang"] == "en" else None
+            first_released = first_released + f'\n{first_en} (EN)'
             desc = series_data.get("book_description", {}).get("description")
         bookwalker_id = str(series_data.get("bookwalker_id"))
         bookwalker_url = BOOKWALKER_ENDPOINT+bookwalker_id if bookwalker_id is not None else None
@@ -113,7 +173,7 @@ class Series:
             publication_status=series_data.get("publication_status"),
             first_released=first_released,
             latest_released=latest_released,
-            image_url=IMAGES_ENDPOINT+series_data["books"][0]["image"]["filename"],
+            image_url=IMAGES_ENDPOINT+books[0]["image"]["filename"],
             bookwalker_url=bookwalker_url,
             author=author,
             illustrator=illustrator,
@@ -122,12 +182,12 @@ class Series:
             lang=series_data["lang"],
             tags=tags,
             licensed=licensed,
-            volumes=volumes
+            books=books
         )
 
 ####### Misc Functions 2 #######
 
-def create_embed(color, title, description, publication_status, first_released, latest_released, author, illustrator, publishers, image, bw_url, tags):
+def create_embed(color, title, description, publication_status, first_released, latest_released, author, illustrator, publishers, image, bw_url, tags, extra_fields=()):
     embed = Embed(color=color, title=title, description=description)
     embed.set_image(url=image)
     embed.add_field(name="Author", value=",\n".join(author), inline=True)
@@ -137,6 +197,8 @@ def create_embed(color, title, description, publication_status, first_released,
     embed.add_field(name="Latest Release", value=latest_released, inline=True)
     embed.add_field(name="Publication Status", value=publication_status.capitalize(), inline=True)
     embed.add_field(name="Publisher(s)", value=publishers, inline=False)
+    for name, value in extra_fields:
+        embed.add_field(name=name, value=value, inline=True)
     embed.set_footer(text="Data fetched from RanobeDB")
     if bw_url is not None:
         embed.add_field(name="Links", value=f"[Bookwalker (JP)]({bw_url})", inline=False)
@@ -144,21 +206,134 @@ def create_embed(color, title, description, publication_status, first_released,
         embed.add_field(name="Tags", value=", ".join(tags), inline=False)
     return embed
 
-async def fetch_page(session, url, page, params):
-    params.update({'page':page})
-    async with session.get(url, params=params) as resp:
-        return await resp.json()
+def release_fields(stats, predict, licensed):
+    # Embed fields for the release statistics
+    from release_stats import to_date
+    fields = []
+    today = date.today()
+    if predict and stats.jp.latest is not None and to_date(stats.jp.latest) <= today and stats.jp.next_expected is not None:
+        expected = to_date(stats.jp.next_expected)
+        if expected < today:
+            fields.append(("Next Volume Expected", f"Overdue since ~{expected} (JP)"))
+        else:
+            fields.append(("Next Volume Expected", f"~{expected} (JP)\n{to_date(stats.jp.next_low)} to {to_date(stats.jp.next_high)}"))
+    if stats.jp.volumes > 1:
+        fields.append(("Release Cadence", f"Every ~{stats.jp.median_gap_days / 30.44:.1f} months (JP)"))
+    if licensed and stats.median_lag_months is not None:
+        fields.append(("EN Lag", f"~{stats.median_lag_months:.1f} months behind JP"))
+    return fields
+
+def parse_search_items(data):
+    return [(item["title"], item["id"]) if item['lang']=='en' else (item["romaji_orig"], item["id"]) for item in data["series"]]
+
+async def fetch_page(url, page, params, semaphore=None):
+    # Every request gets its own copy of the params so concurrent pages can't overwrite each other's 'page'
+    page_params = {**params, 'page': page}
+    if semaphore is None:
+        return await get_json(url, params=page_params)
+    async with semaphore:
+        return await get_json(url, params=page_params)
+
+def search_page_key(page, params):
+    return json.dumps({**params, 'page': page}, sort_keys=True, ensure_ascii=False)
+
+def parse_search_page(data):
+    return {"count": int(data["count"]), "total_pages": data["totalPages"], "items": parse_search_items(data)}
+
+def load_search_page(raw):
+    page = fast_json.loads(raw)
+    page["items"] = [tuple(item) for item in page["items"]]
+    return page
+
+async def fetch_search_page(page, params, semaphore=None):
+    # Parsed search result pages, cached in memory and in the cache database
+    key = search_page_key(page, params)
+    return await search_cache.get_or_fetch(key, lambda: _fetch_search_page(key, page, params, semaphore))
+
+async def _fetch_search_page(key, page, params, semaphore, use_store=True):
+    if use_store:
+        # A copy from the cache database is only kept in memory for as long as it had left there
+        entry = await load_fresh_entry("search", key)
+        if entry is not None:
+            raw, ttl = entry
+            return Expiring(load_search_page(raw), ttl)
+    data = await fetch_page(SERIES_API_ENDPOINT, page, params, semaphore)
+    title_index.add_many(data["series"])
+    result = parse_search_page(data)
+    if cache_store is not None:
+        await cache_store.set("search", key, fast_json.dumps(result), ttl=SEARCH_CACHE_TTL)
+    return result
 
-async def fetch_all_results_async(api_base_url, total_pages, params):
+async def fetch_all_results_async(total_pages, params):
     all_results = []
-    async with aiohttp.ClientSession() as session:
-        tasks = [fetch_page(session, api_base_url, p, params) for p in range(1, total_pages + 1)]
+    semaphore = asyncio.Semaphore(SEARCH_CONCURRENCY)
+    tasks = [fetch_search_page(p, params, semaphore) for p in range(1, total_pages + 1)]
+    with span("search_fanout"):
         pages = await asyncio.gather(*tasks)
-        for data in pages:
-            for item in data["series"]:
-                all_results.append((item["title"], item["id"]) if item['lang']=='en' else (item["romaji_orig"], item["id"]))
+    for data in pages:
+        all_results.extend(data["items"])
     return all_results
 
+class LazySearchResults:
+    # Search results that only hold the API pages someone has actually looked at.
+    # API pages hold `limit` results while result pages shown on Discord hold `items_per_page`
+    def __init__(self, params, count, total_pages, first_page, items_per_page=10):
+        self.params = params
+        self.count = count
+        self.total_pages = total_pages
+        self.items_per_page = items_per_page
+        self.api_page_size = params['limit']
+        self._api_pages = {1: first_page}
+        self._pending = {}
+
+    @property
+    def page_count(self):
+        return math.ceil(self.count / self.items_per_page)
+
+    def _api_page_range(self, page_no):
+        start = (page_no - 1) * self.items_per_page
+        end = min(start + self.items_per_page, self.count)
+        return start, end, start // self.api_page_size + 1, (end - 1) // self.api_page_size + 1
+
+    def is_loaded(self, page_no):
+        _, _, first_api, last_api = self._api_page_range(page_no)
+        return all(p in self._api_pages for p in range(first_api, last_api + 1))
+
+    def _start_fetch(self, api_page):
+        task = self._pending.get(api_page)
+        if task is None:
+            task = asyncio.create_task(fetch_search_page(api_page, self.params))
+            self._pending[api_page] = task
+            task.add_done_callback(lambda t: self._store_api_page(api_page, t))
+        return task
+
+    def _store_api_page(self, api_page, task):
+        self._pending.pop(api_page, None)
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            logger.warning(f"Fetching search results page {api_page} failed", exc_info=task.exception())
+            return
+        self._api_pages[api_page] = task.result()["items"]
+
+    async def _load_api_page(self, api_page):
+        if api_page not in self._api_pages:
+            await asyncio.shield(self._start_fetch(api_page))
+        return self._api_pages[api_page]
+
+    async def get_page(self, page_no):
+        start, end, first_api, last_api = self._api_page_range(page_no)
+        items = []
+        for api_page in range(first_api, last_api + 1):
+            offset = (api_page - 1) * self.api_page_size
+            page_items = await self._load_api_page(api_page)
+            items.extend(page_items[max(start - offset, 0):end - offset])
+        # Start fetching the next API page once the user gets close to the end of this one
+        next_api = last_api + 1
+        if end + SEARCH_PREFETCH_DISTANCE * self.items_per_page > last_api * self.api_page_size and next_api <= self.total_pages and next_api not in self._api_pages:
+            self._start_fetch(next_api)
+        return {name: id_ for name, id_ in items}
+
 def paginate_results(flat_list, items_per_page=10):
     paginated = {}
     total_pages = math.ceil(len(flat_list) / items_per_page)
@@ -167,37 +342,104 @@ def paginate_results(flat_list, items_per_page=10):
         paginated[i + 1] = {name: id_ for name, id_ in chunk}
     return paginated
 
-def fetch_series_info(id):
-    response = requests.get(SERIES_API_ENDPOINT+f'/{str(id)}')
-    data = response.json()
-    series = Series.from_json(data)
-    vol_rel_dates_jp = {}
-    vol_rel_dates_en = {}
-    latest_vol_jp = None
-    latest_vol_en = None
-    latest_release_en = None
-    for vol in sorted(series.volumes, key=lambda v: v.sort_order):
-        vol_rel_dates_jp[vol.sort_order] = vol.jp_release_date
-        latest_vol_jp = vol.title_jp
-        if vol.lang == "en":
-            vol_rel_dates_en[vol.sort_order] = vol.en_release_date
-            latest_vol_en = vol.title_en
-            latest_release_en = vol.en_release_date
+async def fetch_series_info(id):
+    id = int(id)
+    series_popularity.record(id)
+    return await series_cache.get_or_fetch(id, lambda: series_flight.do(id, lambda: _fetch_series_info(id)))
+
+async def fetch_series_json(id, use_store=True):
+    if use_store and cache_store is not None:
+        raw = await cache_store.get("series", id)
+        if raw is not None:
+            return fast_json.loads(raw)
+    with span("series_request"):
+        data = await get_json(SERIES_API_ENDPOINT+f'/{str(id)}')
+    title_index.add(TitleEntry.from_json(data["series"]))
+    if cache_store is not None:
+        await cache_store.set("series", id, fast_json.dumps(data), ttl=SERIES_CACHE_TTL)
+    return data
+
+async def _fetch_series_info(id):
+    entry = await load_fresh_entry("series", id)
+    if entry is not None:
+        raw, ttl = entry
+        return Expiring(build_series_info(fast_json.loads(raw)), ttl)
+    return build_series_info(await fetch_series_json(id, use_store=False))
+
+async def load_fresh_entry(namespace, key, fresh_for=0):
+    # (raw, ttl left) of the cache database copy, if it's good for at least fresh_for more seconds.
+    # In cluster mode that's how a process picks up what another one already refreshed
+    entry = await cache_store.get_entry(namespace, key) if cache_store is not None else None
+    if entry is None:
+        return None
+    raw, expires_at = entry
+    ttl = expires_at - time.time() if expires_at else None
+    if ttl is not None and ttl < fresh_for:
+        return None
+    return raw, ttl
+
+async def load_stored_series_info(id, fresh_for=0):
+    entry = await load_fresh_entry("series", id, fresh_for)
+    if entry is None:
+        return None
+    raw, ttl = entry
+    info = build_series_info(fast_json.loads(raw))
+    series_cache.set(id, info, ttl=ttl)
+    return info
+
+async def refresh_series_info(id):
+    # A fresh copy from the API into both cache tiers, for the hot series warmer
+    info = build_series_info(await fetch_series_json(id, use_store=False))
+    series_cache.set(id, info)
+    return info
+
+async def load_stored_search_page(page, params, fresh_for=0):
+    key = search_page_key(page, params)
+    entry = await load_fresh_entry("search", key, fresh_for)
+    if entry is None:
+        return None
+    raw, ttl = entry
+    result = load_search_page(raw)
+    search_cache.set(key, result, ttl=ttl)
+    return result
+
+async def refresh_search_page(page, params):
+    key = search_page_key(page, params)
+    result = await _fetch_search_page(key, page, params, None, use_store=False)
+    search_cache.set(key, result)
+    return result
+
+def build_series_info(data):
+    with span("series_parse"):
+        series = Series.from_json(data)
+    return series_info(series)
+
+def series_info(series):
+    # release_stats pulls in numpy, so it's imported on first use (or preloaded after startup)
+    from release_stats import compute_release_stats
+    vol_rel_dates_jp, vol_rel_dates_en, latest_vol_jp, latest_vol_en, latest_release_en = series.release_dates()
+    with span("release_stats"):
+        stats = compute_release_stats(vol_rel_dates_jp, vol_rel_dates_en)
     predict = True if series.publication_status == "ongoing" else False
     publishers = f'{series.imprint_ja} (JP)'
     graph_title = f'{series.title}   ({series.imprint_ja})' if len(series.title)<80 else f'{series.title[:80]}.....    ({series.imprint_ja}'
     if series.lang == 'ja':
         description = f"***{series.romaji}***\n\n"+series.description+"\n\n"
-        embed =  create_embed(10216,series.title,description,series.publication_status,series.first_released,series.latest_released,series.author,series.illustrator,publishers,series.image_url,series.bookwalker_url,series.tags)
+        with span("create_embed"):
+            embed =  create_embed(10216,series.title,description,series.publication_status,series.first_released,series.latest_released,series.author,series.illustrator,publishers,series.image_url,series.bookwalker_url,series.tags,release_fields(stats,predict,series.licensed))
     else:
         description = f"***{series.original_title} | {series.original_romaji}***\n\n"+series.description+"\n\n"
         graph_title = f'{graph_title[:-1]} | {series.publisher_en})'
         publishers = publishers + f'\n{series.publisher_en} (EN)'
         latest_released = series.latest_released + f'\n{latest_release_en} (EN)'
-        embed =  create_embed(15204352,series.title,description,series.publication_status,series.first_released,latest_released,series.author,series.illustrator,publishers,series.image_url,series.bookwalker_url,series.tags)
-    return (embed, vol_rel_dates_jp, vol_rel_dates_en, predict, graph_title, latest_vol_jp, latest_vol_en)
+        with span("create_embed"):
+            embed =  create_embed(15204352,series.title,description,series.publication_status,series.first_released,latest_released,series.author,series.illustrator,publishers,series.image_url,series.bookwalker_url,series.tags,release_fields(stats,predict,series.licensed))
+    return (embed, vol_rel_dates_jp, vol_rel_dates_en, predict, graph_title, latest_vol_jp, latest_vol_en, stats)
 
-async def search_series(title, sort, licensed):
+def normalize_query(title, sort, licensed):
+    return (" ".join(title.casefold().split()), sort, licensed)
+
+def search_params(title, sort, licensed):
     params = {
         'q': title,
         'sort': sort,
@@ -209,19 +451,151 @@ async def search_series(title, sort, licensed):
         params.update({'rlExclude': 'en'})
     else:
         pass
-    response = requests.get(SERIES_API_ENDPOINT, params=params)
-    result = response.json()
-    count = int(result['count'])
-    lns = result['series']
-    total_pages = result['totalPages']
+    return params
+
+def picked_series_id(value):
+    # Autocomplete choices carry the series id, so a picked title never needs to be searched for
+    if value.startswith(AUTOCOMPLETE_ID_PREFIX) and value[len(AUTOCOMPLETE_ID_PREFIX):].isdigit():
+        return int(value[len(AUTOCOMPLETE_ID_PREFIX):])
+    return None
+
+def shortcut_series_id(title, licensed):
+    # The series a search goes straight to without asking RanobeDB: one picked from autocomplete or, when
+    # nothing is filtered out, the only indexed series with exactly that title
+    series_id = picked_series_id(title)
+    if series_id is None and TITLE_INDEX_ENABLED and licensed == "Both":
+        matches = title_index.exact(title)
+        if len(matches) == 1:
+            series_id = matches[0].id
+    return series_id
+
+async def search_series(title, sort, licensed):
+    key = normalize_query(title, sort, licensed)
+    query_popularity.record(key, (title, sort, licensed))
+    return await search_flight.do(key, lambda: _search_series(title, sort, licensed))
+
+async def _search_series(title, sort, licensed):
+    series_id = shortcut_series_id(title, licensed)
+    if series_id is not None:
+        return await fetch_series_info(series_id)
+    params = search_params(title, sort, licensed)
+    with span("search_first_page"):
+        result = await fetch_search_page(1, params)
+    count = result['count']
+    lns = result['items']
+    total_pages = result['total_pages']
     if count<1:
         return None
     elif count==1:
-        series_info = fetch_series_info(lns[0]['id'])
+        series_info = await fetch_series_info(lns[0][1])
         return series_info
     elif count>5800:
         return "More than 6000 results.\nBe more specific with the search terms."
+    elif LAZY_SEARCH_RESULTS:
+        return (count, LazySearchResults(params, count, total_pages, lns))
     else:
-        all_data = await fetch_all_results_async(SERIES_API_ENDPOINT, total_pages, params)
+        all_data = await fetch_all_results_async(total_pages, params)
         paged_dict = paginate_results(all_data)
-        return(count,paged_dict)
\ No newline at end of file
+        return(count,paged_dict)
+
+async def resolve_series_id(query):
+    # Series ids are used as they are. Titles go through the title index, then the first page of a search
+    query = query.strip()
+    if query.isdigit():
+        return int(query)
+    series_id = picked_series_id(query)
+    if series_id is not None:
+        return series_id
+    if TITLE_INDEX_ENABLED:
+        matches = title_index.exact(query)
+        if len(matches) == 1:
+            return matches[0].id
+    with span("search_first_page"):
+        result = await fetch_search_page(1, {'q': query, 'sort': 'Relevance desc', 'limit': 100})
+    if not result['items']:
+        return None
+    return result['items'][0][1]
+
+async def fetch_comparison(queries):
+    # All series are resolved and fetched at once, so this takes about as long as the slowest one.
+    # Returns the series as (title, vol_rel_dates_jp, vol_rel_dates_en, stats) and the queries that found nothing
+    async def load(query):
+        series_id = await resolve_series_id(query)
+        if series_id is None:
+            return None
+        return series_id, await fetch_series_info(series_id)
+
+    results = await asyncio.gather(*(load(q) for q in queries), return_exceptions=True)
+    series = {}
+    missing = []
+    for query, result in zip(queries, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Could not load '{query}' for a comparison", exc_info=result)
+            missing.append(query)
+        elif result is None:
+            missing.append(query)
+        else:
+            series_id, (embed, vol_rel_dates_jp, vol_rel_dates_en, *_, stats) = result
+            series.setdefault(series_id, (embed.title, vol_rel_dates_jp, vol_rel_dates_en, stats))
+    return list(series.values()), missing
+
+async def warm_caches():
+    # Preload the most used entries from the cache database so a restart doesn't start cold
+    if cache_store is None:
+        return
+    now = time.time()
+    loaded = 0
+    for key, raw, expires_at in await cache_store.hottest("series"):
+        try:
+            series_cache.set(int(key), build_series_info(fast_json.loads(raw)), ttl=expires_at - now if expires_at else None)
+            loaded += 1
+        except Exception:
+            logger.warning(f"Could not warm series {key} from the cache database", exc_info=True)
+        await asyncio.sleep(0)
+    for key, raw, expires_at in await cache_store.hottest("search"):
+        search_cache.set(key, load_search_page(raw), ttl=expires_at - now if expires_at else None)
+        loaded += 1
+    logger.info(f"Warmed {loaded} series/search entries from the cache database")
+
+
+async def refresh_title_index():
+    # Newest series first so they show up quickly, then a few more pages of the full crawl
+    data = await get_json(SERIES_API_ENDPOINT, params={'sort': 'Release date desc', 'limit': 100, 'page': 1})
+    title_index.add_many(data["series"])
+    for _ in range(TITLE_INDEX_PAGES_PER_REFRESH):
+        data = await get_json(SERIES_API_ENDPOINT, params={'sort': 'Title asc', 'limit': 100, 'page': title_index.crawl_page})
+        title_index.add_many(data["series"])
+        if title_index.crawl_page >= data["totalPages"]:
+            title_index.crawl_page = 1
+            title_index.complete = True
+        else:
+            title_index.crawl_page += 1
+    if cache_store is not None:
+        await cache_store.set("index", "titles", title_index.dumps())
+
+async def load_title_index():
+    if cache_store is None:
+        return
+    raw = await cache_store.get("index", "titles")
+    if raw is not None:
+        for i, entry in enumerate(title_index.loads(raw)):
+            title_index.add(entry)
+            if i % 500 == 0:
+                await asyncio.sleep(0)
+        logger.info(f"Loaded {len(title_index)} titles into the title index")
+
+async def title_index_loop(refresh=True):
+    # In cluster mode only one process crawls RanobeDB, the others pick its index up from the cache database
+    await load_title_index()
+    while True:
+        if refresh:
+            try:
+                await refresh_title_index()
+            except Exception:
+                logger.warning("Refreshing the title index failed", exc_info=True)
+        await asyncio.sleep(TITLE_INDEX_REFRESH_INTERVAL)
+        if not refresh:
+            try:
+                await load_title_index()
+            except Exception:
+                logger.warning("Reloading the title index failed", exc_info=True)
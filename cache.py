@@ -0,0 +1,172 @@
+import sys
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+####### Misc Functions #######
+
+def approx_size(obj, _seen=None):
+    # Rough deep size of an object graph, good enough to keep the cache under its memory cap
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, bytearray, int, float, bool)) or obj is None:
+        return size
+    if isinstance(obj, dict):
+        size += sum(approx_size(k, _seen) + approx_size(v, _seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(approx_size(i, _seen) for i in obj)
+    else:
+        if hasattr(obj, "__dict__"):
+            size += approx_size(vars(obj), _seen)
+        for slot in getattr(type(obj), "__slots__", ()):
+            if hasattr(obj, slot):
+                size += approx_size(getattr(obj, slot), _seen)
+    return size
+
+
+####### Cache Classes #######
+
+class CacheEntry:
+    __slots__ = ("value", "size", "expires_at")
+
+    def __init__(self, value, size, expires_at):
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+
+class Expiring:
+    # What a get_or_fetch fetcher returns to give the value a TTL of its own,
+    # e.g. the time a copy from the cache database had left there
+    __slots__ = ("value", "ttl")
+
+    def __init__(self, value, ttl):
+        self.value = value
+        self.ttl = ttl
+
+def unwrap(value):
+    return (value.value, value.ttl) if isinstance(value, Expiring) else (value, None)
+
+class TTLCache:
+    COUNTERS = ("hits", "stale_hits", "misses", "evictions", "refreshes", "refresh_errors")
+
+    def __init__(self, name, ttl, max_entries=1024, max_bytes=None, sizeof=approx_size):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.total_bytes = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self._entries = OrderedDict()
+        self._refreshing = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, allow_stale=False):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if not allow_stale and entry.expires_at <= time.monotonic():
+            return None
+        self._entries.move_to_end(key)
+        return entry.value
+
+    def expires_in(self, key):
+        # Seconds until the entry expires (negative once it has), None if there's no entry
+        entry = self._entries.get(key)
+        return entry.expires_at - time.monotonic() if entry is not None else None
+
+    def set(self, key, value, size=None, ttl=None):
+        if size is None:
+            size = self.sizeof(value)
+        if ttl is None:
+            ttl = self.ttl
+        if self.max_bytes is not None and size > self.max_bytes:
+            logger.info(f"[{self.name}] Entry {key!r} is larger than the cache ({size} bytes). Not caching it")
+            return
+        self.pop(key)
+        self._entries[key] = CacheEntry(value, size, time.monotonic() + ttl)
+        self.total_bytes += size
+        self._evict()
+
+    def pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        self.total_bytes -= entry.size
+        return entry.value
+
+    def clear(self):
+        self._entries.clear()
+        self.total_bytes = 0
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries or (self.max_bytes is not None and self.total_bytes > self.max_bytes):
+            _, entry = self._entries.popitem(last=False)
+            self.total_bytes -= entry.size
+            self.evictions += 1
+
+    async def get_or_fetch(self, key, fetcher):
+        # Fresh entries are returned as is. Expired entries are still returned straight away
+        # while a single background task fetches a new copy (stale-while-revalidate)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            if entry.expires_at > time.monotonic():
+                self.hits += 1
+            else:
+                self.stale_hits += 1
+                self._schedule_refresh(key, fetcher)
+            return entry.value
+        self.misses += 1
+        value, ttl = unwrap(await fetcher())
+        self.set(key, value, ttl=ttl)
+        return value
+
+    def _schedule_refresh(self, key, fetcher):
+        if key in self._refreshing:
+            return
+        task = asyncio.create_task(self._refresh(key, fetcher))
+        self._refreshing[key] = task
+        task.add_done_callback(lambda _: self._refreshing.pop(key, None))
+
+    async def _refresh(self, key, fetcher):
+        try:
+            value = await fetcher()
+        except Exception:
+            self.refresh_errors += 1
+            logger.warning(f"[{self.name}] Background refresh failed for {key!r}. Keeping the stale copy", exc_info=True)
+            return
+        self.refreshes += 1
+        value, ttl = unwrap(value)
+        self.set(key, value, ttl=ttl)
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors
+        }
+
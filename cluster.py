@@ -0,0 +1,270 @@
+import os
+import sys
+import math
+import time
+import signal
+import asyncio
+import logging
+import argparse
+import resource
+import aiohttp
+from dotenv import load_dotenv
+load_dotenv()
+import fast_json
+from store import cache_store
+from metrics import collect_stats, register_stats
+
+logger = logging.getLogger(__name__)
+
+####### Cluster Settings #######
+# CLUSTER_ID, CLUSTER_COUNT and SHARD_IDS are set for each process by the launcher below.
+# A plain `python bot.py` is cluster 0 of 1 and isn't sharded unless SHARD_COUNT is set
+
+CLUSTER_ID = int(os.getenv("CLUSTER_ID", "0"))
+CLUSTER_COUNT = int(os.getenv("CLUSTER_COUNT", "1"))
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0"))                        # 0 = not sharded (launcher: ask Discord)
+SHARD_IDS = [int(s) for s in os.getenv("SHARD_IDS", "").split(",") if s.strip()] or None   # None = all of them
+CLUSTER_PROCESSES = int(os.getenv("CLUSTER_PROCESSES", "0"))            # 0 = one per CPU core
+CLUSTER_HEALTH_INTERVAL = float(os.getenv("CLUSTER_HEALTH_INTERVAL", "15"))
+CLUSTER_STALE_AFTER = float(os.getenv("CLUSTER_STALE_AFTER", "120"))    # a process that hasn't reported for this long gets restarted
+CLUSTER_REPORT_INTERVAL = float(os.getenv("CLUSTER_REPORT_INTERVAL", "300"))   # 0 = no periodic health log
+
+# The primary process does the work that only needs doing once: command sync, the title index crawl, cache compaction
+IS_PRIMARY = CLUSTER_ID == 0
+
+DISCORD_GATEWAY_URL = "https://discord.com/api/v10/gateway/bot"
+IDENTIFY_INTERVAL = 5.0
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+
+
+####### Health Reports #######
+# Every process writes one row to the shared cache database, which the launcher reads back
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+STARTED = time.time()
+load = {"interactions": 0}
+_last_report = {"time": STARTED, "cpu": cpu_seconds(), "interactions": 0}
+
+register_stats("cluster", "process", lambda: {"cluster_id": CLUSTER_ID, "interactions": load["interactions"]}, counters=("interactions",))
+
+def latency_ms(latency):
+    return round(latency * 1000, 1) if math.isfinite(latency) else None
+
+def health_report(bot):
+    now = time.time()
+    cpu = cpu_seconds()
+    elapsed = max(now - _last_report["time"], 1e-6)
+    latencies = dict(getattr(bot, "latencies", None) or [(bot.shard_id or 0, bot.latency)])
+    stats = collect_stats()
+    report = {
+        "cluster": CLUSTER_ID,
+        "pid": os.getpid(),
+        "shard_latency_ms": {str(shard_id): latency_ms(latencies.get(shard_id, math.inf)) for shard_id in SHARD_IDS or latencies},
+        "guilds": len(bot.guilds),
+        "uptime": now - STARTED,
+        "cpu_percent": (cpu - _last_report["cpu"]) / elapsed * 100,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "interactions": load["interactions"],
+        "interactions_per_min": (load["interactions"] - _last_report["interactions"]) / elapsed * 60,
+        "render_jobs": sum(value for _, value in stats.get("ranobot_render_queued_jobs", [])),
+        "reported_at": now
+    }
+    _last_report.update(time=now, cpu=cpu, interactions=load["interactions"])
+    return report
+
+async def health_loop(bot, interval=CLUSTER_HEALTH_INTERVAL):
+    while True:
+        try:
+            await cache_store.set("health", CLUSTER_ID, fast_json.dumps(health_report(bot)), ttl=CLUSTER_STALE_AFTER * 2)
+        except Exception:
+            logger.warning("Writing the health report failed", exc_info=True)
+        await asyncio.sleep(interval)
+
+async def read_health():
+    return {int(key): fast_json.loads(raw) for key, raw, _ in await cache_store.items("health")}
+
+def format_shards(shard_ids):
+    ids = sorted(int(s) for s in shard_ids)
+    if not ids:
+        return "-"
+    return f"{ids[0]}-{ids[-1]}" if ids == list(range(ids[0], ids[-1] + 1)) and len(ids) > 1 else ",".join(map(str, ids))
+
+def format_health(reports):
+    now = time.time()
+    lines = []
+    for cluster_id, r in sorted(reports.items()):
+        latencies = [l for l in r["shard_latency_ms"].values() if l is not None]
+        lines.append(
+            f"cluster {cluster_id:<3} pid {r['pid']:<8} shards {format_shards(r['shard_latency_ms']):<9} guilds {r['guilds']:<6} "
+            f"cpu {r['cpu_percent']:5.1f}%  rss {r['max_rss_mb']:6.0f}MB  {r['interactions_per_min']:6.1f} interactions/min  "
+            f"render jobs {r['render_jobs']:<3} latency {max(latencies) if latencies else 0:.0f}ms  "
+            f"reported {now - r['reported_at']:.0f}s ago"
+        )
+    return "\n".join(lines) or "No health reports"
+
+
+####### Launcher #######
+
+async def gateway_info(token):
+    # Discord's recommended shard count, and how many shards may identify at once
+    headers = {"Authorization": f"Bot {token}"}
+    async with aiohttp.ClientSession() as session:
+        async with session.get(DISCORD_GATEWAY_URL, headers=headers) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+    return data["shards"], data["session_start_limit"]["max_concurrency"]
+
+def plan_clusters(shard_count, processes):
+    # Contiguous shard ranges, as even as possible
+    processes = max(1, min(processes, shard_count))
+    per, extra = divmod(shard_count, processes)
+    plan = []
+    start = 0
+    for i in range(processes):
+        n = per + (1 if i < extra else 0)
+        plan.append(list(range(start, start + n)))
+        start += n
+    return plan
+
+async def wait_for(event, timeout):
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+class ClusterProcess:
+    def __init__(self, cluster_id, shard_ids, shard_count, cluster_count):
+        self.cluster_id = cluster_id
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.cluster_count = cluster_count
+        self.process = None
+        self.started_at = 0.0
+        self.restarts = 0
+
+    def env(self):
+        env = dict(os.environ)
+        env.update(
+            CLUSTER_ID=str(self.cluster_id),
+            CLUSTER_COUNT=str(self.cluster_count),
+            SHARD_IDS=",".join(map(str, self.shard_ids)),
+            SHARD_COUNT=str(self.shard_count),
+            LOG_FILE=f"bot-cluster{self.cluster_id}.log"
+        )
+        # RanobeDB's rate limit applies to the whole box, so every process gets its share of it (and of the warming budget)
+        env["RANOBEDB_RATE_LIMIT"] = str(float(os.getenv("RANOBEDB_RATE_LIMIT", "10")) / self.cluster_count)
+        env["RANOBEDB_RATE_BURST"] = str(max(1, int(os.getenv("RANOBEDB_RATE_BURST", "20")) // self.cluster_count))
+        env["HOT_WARM_API_BUDGET"] = str(max(1, int(os.getenv("HOT_WARM_API_BUDGET", "20")) // self.cluster_count))
+        metrics_port = int(os.getenv("METRICS_PORT", "0"))
+        if metrics_port:
+            env["METRICS_PORT"] = str(metrics_port + self.cluster_id)
+        return env
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.returncode is None
+
+    async def run(self, stopping, delay=0.0):
+        await wait_for(stopping, delay)
+        backoff = 1.0
+        while not stopping.is_set():
+            self.started_at = time.time()
+            self.process = await asyncio.create_subprocess_exec(sys.executable, BOT_SCRIPT, env=self.env())
+            logger.info(f"Started cluster {self.cluster_id} (pid {self.process.pid}) with shards {format_shards(self.shard_ids)}")
+            code = await self.process.wait()
+            if stopping.is_set():
+                break
+            self.restarts += 1
+            backoff = 1.0 if time.time() - self.started_at > 60 else min(backoff * 2, 60.0)
+            logger.warning(f"Cluster {self.cluster_id} exited with code {code}. Restarting it in {backoff:.0f}s")
+            await wait_for(stopping, backoff)
+
+    def stop(self, sig=signal.SIGTERM):
+        if self.running:
+            self.process.send_signal(sig)
+
+async def monitor(clusters, stopping):
+    last_report = time.time()
+    while not stopping.is_set():
+        await wait_for(stopping, CLUSTER_HEALTH_INTERVAL)
+        try:
+            reports = await read_health()
+        except Exception:
+            logger.warning("Reading the health reports failed", exc_info=True)
+            continue
+        now = time.time()
+        for cluster in clusters:
+            report = reports.get(cluster.cluster_id)
+            # Only a report from the current process counts. One that was never ready can't go stale
+            if not cluster.running or report is None or report["pid"] != cluster.process.pid:
+                continue
+            if now - report["reported_at"] > CLUSTER_STALE_AFTER:
+                logger.error(f"Cluster {cluster.cluster_id} hasn't reported for {now - report['reported_at']:.0f}s. Restarting it")
+                cluster.stop(signal.SIGKILL)
+        if CLUSTER_REPORT_INTERVAL and now - last_report >= CLUSTER_REPORT_INTERVAL:
+            last_report = now
+            logger.info(f"Cluster health\n{format_health(reports)}")
+
+async def launch(processes=0):
+    if cache_store is None:
+        raise SystemExit("Cluster mode shares its caches through the cache database. Set CACHE_DB_PATH")
+    token = os.getenv("BOT_TOKEN")
+    if not token:
+        raise SystemExit("Cannot find the token in the .env file. Make sure it is set properly.")
+    if SHARD_COUNT:
+        shard_count, max_concurrency = SHARD_COUNT, 1
+    else:
+        shard_count, max_concurrency = await gateway_info(token)
+    plan = plan_clusters(shard_count, processes or CLUSTER_PROCESSES or os.cpu_count() or 1)
+    clusters = [ClusterProcess(i, shard_ids, shard_count, len(plan)) for i, shard_ids in enumerate(plan)]
+    logger.info(f"Launching {len(clusters)} processes for {shard_count} shards")
+
+    await cache_store.open(compact=False)
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+    # Each process identifies its own shards one after another, so later clusters wait for the earlier
+    # shards to get through Discord's identify limit
+    runners = [asyncio.create_task(c.run(stopping, c.shard_ids[0] / max_concurrency * IDENTIFY_INTERVAL)) for c in clusters]
+    monitor_task = asyncio.create_task(monitor(clusters, stopping))
+
+    await stopping.wait()
+    logger.info("Stopping the cluster")
+    monitor_task.cancel()
+    for cluster in clusters:
+        cluster.stop()
+    done, pending = await asyncio.wait(runners, timeout=30)
+    for cluster in clusters:
+        cluster.stop(signal.SIGKILL)
+    await asyncio.gather(*pending, return_exceptions=True)
+    await cache_store.close()
+
+async def print_status():
+    if cache_store is None:
+        raise SystemExit("Health reports are kept in the cache database. Set CACHE_DB_PATH")
+    await cache_store.open(compact=False)
+    print(format_health(await read_health()))
+    await cache_store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs Ranobot as several processes, each with a slice of the shards")
+    parser.add_argument("--processes", type=int, default=0, help="number of bot processes (default: CLUSTER_PROCESSES or one per core)")
+    parser.add_argument("--status", action="store_true", help="print the latest health report of every process and exit")
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format='[%(asctime)s] [%(levelname)s] [%(name)s] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+    if args.status:
+        asyncio.run(print_status())
+    else:
+        asyncio.run(launch(args.processes))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+import json
+
+# orjson is optional. It decodes the large series responses several times faster than the json module
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(raw):
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+def dumps(obj):
+    # Always returns UTF-8 bytes, which is what the cache database stores
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
@@ -1,9 +1,28 @@
+import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from matplotlib.ticker import MaxNLocator
 import io
+import time
+from dataclasses import dataclass
 from datetime import datetime, date, timedelta
+from typing import Optional
 from matplotlib import font_manager
+from release_stats import compute_release_stats
+
+BACKGROUND = '#1e1e1e'
+JP_COLOR = '#6c5ce7'
+EN_COLOR = '#50ac00'
+MIN_DPI = 72
+
+# Used when no output profile is given, which is the original 300 dpi PNG
+DEFAULT_PROFILE = {"format": "png", "dpi": 300, "compress_level": 6, "max_bytes": None}
+
+_fonts = None
+_template = None
 
 
 def set_xaxis_interval(gap): #using the gap between 1st vol and the latest
@@ -17,87 +36,143 @@ def set_xaxis_interval(gap): #using the gap between 1st vol and the latest
         interval = 6
     return interval
 
+def load_fonts():
+    # Had to do this because titles weren't being displayed properly
+    ### Need to remember to remove this from the git repo
+    global _fonts
+    if _fonts is None:
+        font_path_regular = "./fonts/NotoSansCJK-Regular.ttc"
+        jp_font_regular = font_manager.FontProperties(fname=font_path_regular)
+        font_path_bold = "./fonts/NotoSansCJK-Bold.ttc"
+        jp_font_bold = font_manager.FontProperties(fname=font_path_bold)
+        _fonts = (jp_font_regular, jp_font_bold)
+    #### Remove the above before running if you are self-hosting ####
+    return _fonts
+
 def months_between_vols(d1, d2):
     return (d2.year - d1.year) * 12 + (d2.month - d1.month)
 
-def generate_graph(vol_rel_dates_jp, vol_rel_dates_en, predict, title, latest_vol_jp, latest_vol_en):
+def fig_width(volume_count):
+    return min(30, max(16, volume_count * 0.4))
+
+
+######## Graph Data ########
+
+@dataclass
+class GraphData:
+    jp_vols: tuple
+    jp_dates: tuple
+    en_vols: tuple
+    en_dates: tuple
+    interval: int
+    avg_gap_months_jp: float
+    avg_gap_months_en: float
+    latest_date_jp: str
+    latest_date_en: str
+    predicted_jp: Optional[tuple] = None     # (volume, expected date, earliest, latest)
+    predicted_en: Optional[tuple] = None
+    show_today: bool = False
 
+def prepare_graph_data(vol_rel_dates_jp, vol_rel_dates_en, predict, stats=None):
+    # Everything both renderers draw, worked out once. The statistics normally come with the series
     today = datetime.today().date()
+    if stats is None:
+        stats = compute_release_stats(vol_rel_dates_jp, vol_rel_dates_en)
 
     dates_jp = vol_rel_dates_jp.values()
     total_months_jp = months_between_vols(min(dates_jp), max(dates_jp)) + 1
     interval = set_xaxis_interval(total_months_jp)
 
-    jp_vols, jp_dates = zip(*[(vol, dates) for vol, dates in vol_rel_dates_jp.items()])
-
+    jp_vols, jp_dates = zip(*vol_rel_dates_jp.items())
     latest_date_jp = f'  -  [{jp_dates[-1].strftime("%d %b %Y")}]'
 
-    gaps_bw_months_jp = [months_between_vols(jp_dates[i], jp_dates[i+1]) for i in range(len(jp_dates) - 1)]
-    avg_gap_months_jp = sum(gaps_bw_months_jp) / len(gaps_bw_months_jp)
-
-    en_plot = False
-    en_predict = False
+    en_vols, en_dates = (), ()
     latest_date_en = ""
-    avg_gap_months_en = 0
     if vol_rel_dates_en:
-        en_plot = True
-        en_vols, en_dates = zip(*[(vol, dates) for vol, dates in vol_rel_dates_en.items()])
+        en_vols, en_dates = zip(*vol_rel_dates_en.items())
         latest_date_en = f'  -  [{en_dates[-1].strftime("%d %b %Y")}]'
-        if len(vol_rel_dates_en) > 1:
-            if en_dates[-1] < today:
-                en_predict = True
-            gaps_bw_months_en = [months_between_vols(en_dates[i], en_dates[i+1]) for i in range(len(en_dates) - 1)]
-            avg_gap_months_en = sum(gaps_bw_months_en) / len(gaps_bw_months_en)
 
-    # Had to do this because titles weren't being displayed properly
-    ### Need to remember to remove this from the git repo
-    font_path_regular = "./fonts/NotoSansCJK-Regular.ttc"
-    jp_font_regular = font_manager.FontProperties(fname=font_path_regular)
-    font_path_bold = "./fonts/NotoSansCJK-Bold.ttc"
-    jp_font_bold = font_manager.FontProperties(fname=font_path_bold)
-    #### Remove the above before running if you are self-hosting ####
+    show_today = False
+    if jp_dates[-1] > today:
+        predict = False
+        show_today = True
+    predicted_jp = predicted_en = None
+    if predict:
+        show_today = True
+        predicted_jp = (jp_vols[-1]+1, *stats.jp.next_release(today))
+        if len(en_dates) > 1 and en_dates[-1] < today:
+            predicted_en = (en_vols[-1]+1, *stats.en.next_release(today))
+    if en_dates and en_dates[-1] > today:
+        show_today = True
+
+    return GraphData(jp_vols, jp_dates, en_vols, en_dates, interval, stats.jp.avg_gap_months, stats.en.avg_gap_months,
+                     latest_date_jp, latest_date_en, predicted_jp, predicted_en, show_today)
+
+def footer_lines(data, latest_vol_jp, latest_vol_en):
+    return (
+        f'‣ Average Monthly Gap —— JP: {data.avg_gap_months_jp:.2f}  |  EN: {data.avg_gap_months_en:.2f}',
+        f'- Latest Release ——  JP:    {latest_vol_jp}{data.latest_date_jp}\n                                           EN:  {latest_vol_en}{data.latest_date_en}'
+    )
+
+
+####### Output #######
+
+def encode(fig, profile, bbox_inches=None):
+    # Steps the dpi down until the image fits the profile's byte budget
+    dpi = profile["dpi"]
+    if profile["format"] == "webp":
+        pil_kwargs = {"quality": profile.get("quality", 80), "method": profile.get("method", 4)}
+    else:
+        pil_kwargs = {"compress_level": profile.get("compress_level", 6)}
+    while True:
+        buf = io.BytesIO()
+        fig.savefig(buf, format=profile["format"], dpi=dpi, bbox_inches=bbox_inches, pil_kwargs=pil_kwargs)
+        max_bytes = profile.get("max_bytes")
+        if not max_bytes or buf.tell() <= max_bytes or dpi <= MIN_DPI:
+            break
+        dpi = max(MIN_DPI, int(dpi * 0.75))
+    buf.seek(0)
+    return buf
+
+
+####### Classic Renderer #######
+# Builds a new pyplot figure for every graph
+
+def generate_graph(vol_rel_dates_jp, vol_rel_dates_en, predict, title, latest_vol_jp, latest_vol_en, stats=None, timings=None, profile=None):
+
+    build_start = time.perf_counter()
+    data = prepare_graph_data(vol_rel_dates_jp, vol_rel_dates_en, predict, stats)
+    jp_vols, jp_dates = data.jp_vols, data.jp_dates
+    en_vols, en_dates = data.en_vols, data.en_dates
+
+    jp_font_regular, jp_font_bold = load_fonts()
 
     plt.style.use('dark_background')
-    fig_width =  min(30, max(16, len(jp_vols) * 0.4))
-    fig, ax = plt.subplots(figsize=(fig_width, 6))
-    fig.patch.set_facecolor('#1e1e1e')  # dark gray background for the figure
-    ax.set_facecolor('#1e1e1e')         # dark gray background for the plot area
+    fig, ax = plt.subplots(figsize=(fig_width(len(jp_vols)), 6))
+    fig.patch.set_facecolor(BACKGROUND)  # dark gray background for the figure
+    ax.set_facecolor(BACKGROUND)         # dark gray background for the plot area
     ax.yaxis.grid(True, color='white', linestyle='-', alpha=0.3)
     ax.xaxis.grid(False)
-    ax.plot(jp_dates, jp_vols, label="JP", color="#6c5ce7", marker="o")
-    if jp_dates[-1] > datetime.today().date():
-        predict=False
-        ax.axvline(datetime.today(), color="red", linewidth=2)
-    if en_plot:
-        ax.plot(en_dates, en_vols, label="EN", color="#50ac00", marker="o")
-    if predict:
-        gaps = [(jp_dates[i+1] - jp_dates[i]).days for i in range(len(jp_dates) - 1)]
-        avg_gap = sum(gaps) / len(gaps)
-        predicted_date = jp_dates[-1] + timedelta(days=avg_gap)
-        if predicted_date < datetime.today().date():
-            predicted_date = datetime.today().date()
-        predicted_vol = jp_vols[-1]+1
+    ax.plot(jp_dates, jp_vols, label="JP", color=JP_COLOR, marker="o")
+    if en_dates:
+        ax.plot(en_dates, en_vols, label="EN", color=EN_COLOR, marker="o")
+    if data.predicted_jp is not None:
+        predicted_vol, predicted_date, earliest, latest = data.predicted_jp
         ax.plot([jp_dates[-1], predicted_date], [jp_vols[-1], predicted_vol],
-            linestyle='dotted', color='#6c5ce7', label='Predicted Next Vol')
-        plt.scatter(predicted_date, predicted_vol, edgecolors='gray', facecolors='none')
-        if en_predict:
-            gaps_en = [(en_dates[i+1] - en_dates[i]).days for i in range(len(en_dates) - 1)]
-            avg_gap_en = sum(gaps_en) / len(gaps_en)
-            predicted_date_en = en_dates[-1] + timedelta(days=avg_gap_en)
-            if predicted_date_en < datetime.today().date():
-                predicted_date_en = datetime.today().date()
-            predicted_vol_en = en_vols[-1]+1
-            ax.plot([en_dates[-1], predicted_date_en], [en_vols[-1], predicted_vol_en],
-                linestyle='dotted', color='#50ac00', label='Predicted Next Vol EN')
-            plt.scatter(predicted_date_en, predicted_vol_en, edgecolors='gray', facecolors='none')
+            linestyle='dotted', color=JP_COLOR, label='Predicted Next Vol')
+        ax.plot([earliest, latest], [predicted_vol, predicted_vol], color='gray', linewidth=3, alpha=0.6)
+        ax.scatter(predicted_date, predicted_vol, edgecolors='gray', facecolors='none')
+    if data.predicted_en is not None:
+        predicted_vol_en, predicted_date_en, earliest_en, latest_en = data.predicted_en
+        ax.plot([en_dates[-1], predicted_date_en], [en_vols[-1], predicted_vol_en],
+            linestyle='dotted', color=EN_COLOR, label='Predicted Next Vol EN')
+        ax.plot([earliest_en, latest_en], [predicted_vol_en, predicted_vol_en], color='gray', linewidth=3, alpha=0.6)
+        ax.scatter(predicted_date_en, predicted_vol_en, edgecolors='gray', facecolors='none')
+    if data.show_today:
         ax.axvline(datetime.today(), color="red", linewidth=2)
 
-    if vol_rel_dates_en:
-        if en_dates[-1] > today:
-            ax.axvline(datetime.today(), color="red", linewidth=2)
-
     ax.xaxis.set_major_formatter(mdates.DateFormatter('%b %y'))
-    ax.xaxis.set_major_locator(mdates.MonthLocator(interval=interval))
+    ax.xaxis.set_major_locator(mdates.MonthLocator(interval=data.interval))
     fig.autofmt_xdate(rotation=45)
 
     for spine in ['left', 'top', 'right']:
@@ -108,7 +183,7 @@ def generate_graph(vol_rel_dates_jp, vol_rel_dates_en, predict, title, latest_vo
     ax.set_ylim(bottom=0)
     ax.yaxis.set_major_locator(MaxNLocator(integer=True))  # integer volume numbers only
 
-    plt.subplots_adjust(
+    fig.subplots_adjust(
         left=0.07,
         right=0.98,
         top=0.93,
@@ -120,14 +195,192 @@ def generate_graph(vol_rel_dates_jp, vol_rel_dates_en, predict, title, latest_vo
     ax.set_ylabel("Volumes", fontsize=12, labelpad=6)
     ax.legend(loc='upper center', bbox_to_anchor=(0.5, -0.24), ncols=4, frameon=False)
 
-    fig.text(0.05, 0.12, f'‣ Average Monthly Gap —— JP: {avg_gap_months_jp:.2f}  |  EN: {avg_gap_months_en:.2f}',
-            ha='left', va='bottom', fontsize=10, wrap=True)
-    fig.text(0.05, 0.045, f'- Latest Release ——  JP:    {latest_vol_jp}{latest_date_jp}\n                                           EN:  {latest_vol_en}{latest_date_en}',
-            ha='left', va='bottom', fontsize=10, wrap=True, fontproperties=jp_font_regular)
-    
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', bbox_inches='tight', dpi=300)
-    buf.seek(0)
+    gap_line, latest_line = footer_lines(data, latest_vol_jp, latest_vol_en)
+    fig.text(0.05, 0.12, gap_line, ha='left', va='bottom', fontsize=10, wrap=True)
+    fig.text(0.05, 0.045, latest_line, ha='left', va='bottom', fontsize=10, wrap=True, fontproperties=jp_font_regular)
+
+    save_start = time.perf_counter()
+    buf = encode(fig, profile or DEFAULT_PROFILE, bbox_inches='tight')
     plt.close(fig)
+    if timings is not None:
+        timings["graph_build"] = save_start - build_start
+        timings["graph_savefig"] = time.perf_counter() - save_start
+
+    return buf
 
-    return buf
\ No newline at end of file
+
+####### Template Renderer #######
+# One pre-styled figure per render worker. Each graph only swaps in its data and text,
+# and is saved without the extra layout pass bbox_inches='tight' needs
+
+class GraphTemplate:
+    def __init__(self):
+        jp_font_regular, jp_font_bold = load_fonts()
+        plt.style.use('dark_background')
+        self.fig = Figure(figsize=(16, 6), facecolor=BACKGROUND)
+        FigureCanvasAgg(self.fig)
+        self.fig.subplots_adjust(left=0.07, right=0.98, top=0.93, bottom=0.34)
+        ax = self.ax = self.fig.add_subplot()
+        ax.set_facecolor(BACKGROUND)
+        ax.xaxis_date()
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%b %y'))
+        ax.yaxis.grid(True, color='white', linestyle='-', alpha=0.3)
+        ax.xaxis.grid(False)
+        for spine in ['left', 'top', 'right']:
+            ax.spines[spine].set_visible(False)
+        ax.spines['bottom'].set_color('gray')
+        ax.tick_params(axis='x', labelrotation=45)
+        ax.tick_params(axis='y', which='both', length=0, pad=10)
+        ax.yaxis.set_major_locator(MaxNLocator(integer=True))  # integer volume numbers only
+        ax.set_title(" ", fontsize=14, fontproperties=jp_font_bold)
+        ax.set_xlabel("Date Published", fontsize=12, labelpad=8)
+        ax.set_ylabel("Volumes", fontsize=12, labelpad=6)
+
+        self.jp_line, = ax.plot([], [], label="JP", color=JP_COLOR, marker="o")
+        self.en_line, = ax.plot([], [], label="EN", color=EN_COLOR, marker="o")
+        self.jp_predicted, = ax.plot([], [], linestyle='dotted', color=JP_COLOR, label='Predicted Next Vol')
+        self.en_predicted, = ax.plot([], [], linestyle='dotted', color=EN_COLOR, label='Predicted Next Vol EN')
+        self.jp_predicted_band, = ax.plot([], [], color='gray', linewidth=3, alpha=0.6)
+        self.en_predicted_band, = ax.plot([], [], color='gray', linewidth=3, alpha=0.6)
+        self.jp_predicted_point = ax.scatter([], [], edgecolors='gray', facecolors='none')
+        self.en_predicted_point = ax.scatter([], [], edgecolors='gray', facecolors='none')
+        self.today_line = ax.axvline(0, color="red", linewidth=2)
+
+        self.gap_text = self.fig.text(0.05, 0.12, "", ha='left', va='bottom', fontsize=10, wrap=True)
+        self.latest_text = self.fig.text(0.05, 0.045, "", ha='left', va='bottom', fontsize=10, wrap=True, fontproperties=jp_font_regular)
+
+    def _set_prediction(self, line, band, point, last_date, last_vol, predicted):
+        visible = predicted is not None
+        for artist in (line, band, point):
+            artist.set_visible(visible)
+        if visible:
+            predicted_vol, predicted_date, earliest, latest = predicted
+            line.set_data(mdates.date2num([last_date, predicted_date]), [last_vol, predicted_vol])
+            band.set_data(mdates.date2num([earliest, latest]), [predicted_vol, predicted_vol])
+            point.set_offsets([[mdates.date2num(predicted_date), predicted_vol]])
+        return visible
+
+    def render(self, vol_rel_dates_jp, vol_rel_dates_en, predict, title, latest_vol_jp, latest_vol_en, stats=None, timings=None, profile=None):
+        build_start = time.perf_counter()
+        data = prepare_graph_data(vol_rel_dates_jp, vol_rel_dates_en, predict, stats)
+        ax = self.ax
+        self.fig.set_size_inches(fig_width(len(data.jp_vols)), 6)
+
+        self.jp_line.set_data(mdates.date2num(data.jp_dates), data.jp_vols)
+        handles = [self.jp_line]
+        self.en_line.set_visible(bool(data.en_dates))
+        if data.en_dates:
+            self.en_line.set_data(mdates.date2num(data.en_dates), data.en_vols)
+            handles.append(self.en_line)
+        else:
+            self.en_line.set_data([], [])
+        if self._set_prediction(self.jp_predicted, self.jp_predicted_band, self.jp_predicted_point, data.jp_dates[-1], data.jp_vols[-1], data.predicted_jp):
+            handles.append(self.jp_predicted)
+        if self._set_prediction(self.en_predicted, self.en_predicted_band, self.en_predicted_point,
+                                data.en_dates[-1] if data.en_dates else None, data.en_vols[-1] if data.en_vols else None, data.predicted_en):
+            handles.append(self.en_predicted)
+        today = mdates.date2num(datetime.today())
+        self.today_line.set_xdata([today, today])
+        self.today_line.set_visible(data.show_today)
+
+        # set_ylim below turns y autoscaling off, and the axes are reused by the next render
+        ax.set_autoscaley_on(True)
+        ax.relim(visible_only=True)
+        for point in (self.jp_predicted_point, self.en_predicted_point):
+            if point.get_visible():
+                ax.update_datalim(point.get_offsets())
+        ax.autoscale_view()
+        ax.set_ylim(bottom=0)
+        ax.xaxis.set_major_locator(mdates.MonthLocator(interval=data.interval))
+        for label in ax.get_xticklabels():
+            label.set_horizontalalignment('right')
+
+        ax.title.set_text(title)
+        ax.legend(handles=handles, loc='upper center', bbox_to_anchor=(0.5, -0.24), ncols=4, frameon=False)
+        gap_line, latest_line = footer_lines(data, latest_vol_jp, latest_vol_en)
+        self.gap_text.set_text(gap_line)
+        self.latest_text.set_text(latest_line)
+
+        save_start = time.perf_counter()
+        buf = encode(self.fig, profile or DEFAULT_PROFILE)
+        if timings is not None:
+            timings["graph_build"] = save_start - build_start
+            timings["graph_savefig"] = time.perf_counter() - save_start
+        return buf
+
+def get_template():
+    global _template
+    if _template is None:
+        _template = GraphTemplate()
+    return _template
+
+def render(args, engine="template", profile=None, timings=None):
+    if engine == "classic":
+        return generate_graph(*args, timings=timings, profile=profile)
+    return get_template().render(*args, timings=timings, profile=profile)
+
+
+####### Comparison Graph #######
+
+COMPARE_COLORS = [JP_COLOR, EN_COLOR, '#e17055', '#00cec9', '#fdcb6e', '#e84393', '#74b9ff', '#b2bec3']
+
+def generate_comparison_graph(series, timings=None, profile=None):
+    # series is a list of (title, vol_rel_dates_jp, vol_rel_dates_en, stats). JP releases are solid lines, EN dashed
+    build_start = time.perf_counter()
+    jp_font_regular, jp_font_bold = load_fonts()
+
+    all_dates = [d for _, jp, en, _ in series for d in (*jp.values(), *en.values())]
+    interval = set_xaxis_interval(months_between_vols(min(all_dates), max(all_dates)) + 1)
+    most_volumes = max(len(jp) for _, jp, _, _ in series)
+
+    plt.style.use('dark_background')
+    fig, ax = plt.subplots(figsize=(fig_width(most_volumes), 7))
+    fig.patch.set_facecolor(BACKGROUND)
+    ax.set_facecolor(BACKGROUND)
+    ax.yaxis.grid(True, color='white', linestyle='-', alpha=0.3)
+    ax.xaxis.grid(False)
+
+    footer = []
+    for (title, vol_rel_dates_jp, vol_rel_dates_en, stats), color in zip(series, COMPARE_COLORS):
+        name = title if len(title) <= 40 else f'{title[:40]}...'
+        jp_vols, jp_dates = zip(*vol_rel_dates_jp.items())
+        ax.plot(jp_dates, jp_vols, label=f'{name} (JP)', color=color, marker="o", markersize=4)
+        if stats is None:
+            stats = compute_release_stats(vol_rel_dates_jp, vol_rel_dates_en)
+        gaps = f'JP: {stats.jp.avg_gap_months:.2f}'
+        if vol_rel_dates_en:
+            en_vols, en_dates = zip(*vol_rel_dates_en.items())
+            ax.plot(en_dates, en_vols, label=f'{name} (EN)', color=color, linestyle='dashed', marker="o", markersize=3, alpha=0.8)
+            gaps += f'  |  EN: {stats.en.avg_gap_months:.2f}'
+            if stats.median_lag_months is not None:
+                gaps += f'  |  EN lag: {stats.median_lag_months:.1f} months'
+        footer.append(f'‣ {name} —— {gaps}')
+    ax.axvline(datetime.today(), color="red", linewidth=2)
+
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%b %y'))
+    ax.xaxis.set_major_locator(mdates.MonthLocator(interval=interval))
+    fig.autofmt_xdate(rotation=45)
+    for spine in ['left', 'top', 'right']:
+        ax.spines[spine].set_visible(False)
+    ax.spines['bottom'].set_color('gray')
+    ax.tick_params(axis='y', which='both', length=0, pad=10)
+    ax.set_ylim(bottom=0)
+    ax.yaxis.set_major_locator(MaxNLocator(integer=True))  # integer volume numbers only
+
+    # The footer grows with the number of series
+    bottom = 0.17 + 0.025 * (len(series) + 1)
+    fig.subplots_adjust(left=0.07, right=0.98, top=0.93, bottom=bottom)
+    ax.set_title("Release Comparison", fontsize=14, fontproperties=jp_font_bold)
+    ax.set_xlabel("Date Published", fontsize=12, labelpad=8)
+    ax.set_ylabel("Volumes", fontsize=12, labelpad=6)
+    ax.legend(loc='upper left', ncols=2, frameon=False, prop=jp_font_regular)
+    fig.text(0.05, 0.02, "Average Monthly Gap\n" + "\n".join(footer),
+             ha='left', va='bottom', fontsize=10, fontproperties=jp_font_regular)
+
+    save_start = time.perf_counter()
+    buf = encode(fig, profile or DEFAULT_PROFILE)
+    plt.close(fig)
+    if timings is not None:
+        timings["graph_build"] = save_start - build_start
+        timings["graph_savefig"] = time.perf_counter() - save_start
+    return buf
@@ -0,0 +1,193 @@
+import os
+import time
+import random
+import asyncio
+import aiohttp
+import logging
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import fast_json
+from metrics import register_stats
+
+logger = logging.getLogger(__name__)
+
+####### Client Settings #######
+# All of these can be overridden from the .env file
+
+CONN_LIMIT = int(os.getenv("RANOBEDB_CONN_LIMIT", "100"))
+CONN_LIMIT_PER_HOST = int(os.getenv("RANOBEDB_CONN_LIMIT_PER_HOST", "20"))
+DNS_CACHE_TTL = int(os.getenv("RANOBEDB_DNS_CACHE_TTL", "300"))
+KEEPALIVE_TIMEOUT = float(os.getenv("RANOBEDB_KEEPALIVE_TIMEOUT", "60"))
+TOTAL_TIMEOUT = float(os.getenv("RANOBEDB_TIMEOUT", "15"))
+CONNECT_TIMEOUT = float(os.getenv("RANOBEDB_CONNECT_TIMEOUT", "5"))
+USER_AGENT = os.getenv("RANOBEDB_USER_AGENT", "Ranobot (https://github.com/Agrayne/Ranobot)")
+RATE_LIMIT = float(os.getenv("RANOBEDB_RATE_LIMIT", "10"))          # requests per second
+RATE_BURST = int(os.getenv("RANOBEDB_RATE_BURST", "20"))
+MAX_RETRIES = int(os.getenv("RANOBEDB_MAX_RETRIES", "3"))
+BACKOFF_BASE = float(os.getenv("RANOBEDB_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.getenv("RANOBEDB_BACKOFF_MAX", "10"))
+RETRY_AFTER_MAX = float(os.getenv("RANOBEDB_RETRY_AFTER_MAX", "60"))
+
+_session: aiohttp.ClientSession | None = None
+_session_lock = asyncio.Lock()
+
+counters = {
+    "requests": 0,
+    "retries": 0,
+    "throttled": 0,             # 429 responses
+    "server_errors": 0,         # 5xx responses
+    "timeouts": 0,
+    "connection_errors": 0,
+    "failures": 0,              # requests that gave up after all retries
+    "rate_limit_waits": 0,
+    "rate_limit_wait_seconds": 0.0
+}
+register_stats("http", "ranobedb", lambda: counters, counters=counters)
+
+
+####### Rate Limiting #######
+
+class TokenBucket:
+    # Global limit on requests sent to RanobeDB. The rate is halved whenever we get throttled
+    # and slowly creeps back up to the configured rate as requests succeed
+    def __init__(self, rate, burst):
+        self.max_rate = rate
+        self.min_rate = rate / 8
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            waited = 0.0
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    delay = self.paused_until - now
+                else:
+                    self._refill()
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        break
+                    delay = (1 - self.tokens) / self.rate
+                waited += delay
+                await asyncio.sleep(delay)
+            if waited:
+                counters["rate_limit_waits"] += 1
+                counters["rate_limit_wait_seconds"] += waited
+
+    def throttled(self, retry_after=None):
+        self._refill()
+        self.rate = max(self.min_rate, self.rate / 2)
+        if retry_after:
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+    def succeeded(self):
+        if self.rate < self.max_rate:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 50)
+
+_bucket = TokenBucket(RATE_LIMIT, RATE_BURST)
+
+
+####### Session Handling #######
+
+async def get_session():
+    # One session for the whole bot so the connection pool (and its keep-alive sockets) is reused
+    global _session
+    if _session is not None and not _session.closed:
+        return _session
+    async with _session_lock:
+        if _session is None or _session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=CONN_LIMIT,
+                limit_per_host=CONN_LIMIT_PER_HOST,
+                ttl_dns_cache=DNS_CACHE_TTL,
+                use_dns_cache=True,
+                keepalive_timeout=KEEPALIVE_TIMEOUT,
+                enable_cleanup_closed=True
+            )
+            timeout = aiohttp.ClientTimeout(total=TOTAL_TIMEOUT, connect=CONNECT_TIMEOUT)
+            _session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=timeout,
+                headers={"User-Agent": USER_AGENT}
+            )
+            logger.info(f"Opened RanobeDB HTTP session (limit={CONN_LIMIT}, per_host={CONN_LIMIT_PER_HOST})")
+    return _session
+
+async def close_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+        logger.info("Closed RanobeDB HTTP session")
+    _session = None
+
+
+####### Requests #######
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), RETRY_AFTER_MAX)
+
+def backoff_delay(attempt, retry_after=None):
+    # Full jitter, but never earlier than the server asked us to come back
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+    if retry_after is not None:
+        delay += retry_after
+    return delay
+
+async def get_json(url, params=None):
+    session = await get_session()
+    attempt = 0
+    while True:
+        await _bucket.acquire()
+        counters["requests"] += 1
+        retry_after = None
+        try:
+            async with session.get(url, params=params) as resp:
+                if resp.status == 429 or resp.status >= 500:
+                    retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+                    if resp.status == 429:
+                        counters["throttled"] += 1
+                        _bucket.throttled(retry_after)
+                    else:
+                        counters["server_errors"] += 1
+                    if attempt >= MAX_RETRIES:
+                        counters["failures"] += 1
+                        resp.raise_for_status()
+                else:
+                    resp.raise_for_status()
+                    _bucket.succeeded()
+                    return fast_json.loads(await resp.read())
+        except asyncio.TimeoutError:
+            counters["timeouts"] += 1
+            if attempt >= MAX_RETRIES:
+                counters["failures"] += 1
+                raise
+        except aiohttp.ClientConnectionError:
+            counters["connection_errors"] += 1
+            if attempt >= MAX_RETRIES:
+                counters["failures"] += 1
+                raise
+        delay = backoff_delay(attempt, retry_after)
+        logger.info(f"Retrying {url} in {delay:.2f}s (attempt {attempt + 1} of {MAX_RETRIES})")
+        counters["retries"] += 1
+        attempt += 1
+        await asyncio.sleep(delay)
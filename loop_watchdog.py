@@ -0,0 +1,109 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import Counter
+from metrics import histogram, register_stats
+
+logger = logging.getLogger(__name__)
+
+####### Watchdog Settings #######
+
+LOOP_WATCHDOG = os.getenv("LOOP_WATCHDOG", "0") == "1"
+LOOP_WATCHDOG_INTERVAL = float(os.getenv("LOOP_WATCHDOG_INTERVAL", "0.05"))     # seconds between heartbeats
+LOOP_WATCHDOG_THRESHOLD = float(os.getenv("LOOP_WATCHDOG_THRESHOLD", "0.25"))   # blocked longer than this gets reported
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class LoopWatchdog:
+    # A heartbeat task on the loop measures how late it wakes up (the loop lag), while a
+    # separate thread checks the heartbeat and grabs the loop thread's stack when it stops beating
+    def __init__(self, interval=LOOP_WATCHDOG_INTERVAL, threshold=LOOP_WATCHDOG_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.lag = histogram("event_loop_lag_seconds")
+        self.stalls = 0
+        self.max_blocked = 0.0
+        self.call_sites = Counter()
+        self.last_beat = time.monotonic()
+        self._loop_thread_id = None
+        self._task = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._monitor, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"Event loop watchdog started (threshold {self.threshold * 1000:.0f}ms)")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.lag.observe(max(0.0, now - expected))
+            self.last_beat = now
+
+    def _monitor(self):
+        reported_beat = None
+        while not self._stop.wait(self.interval):
+            beat = self.last_beat
+            blocked = time.monotonic() - beat - self.interval
+            if blocked < self.threshold:
+                continue
+            self.max_blocked = max(self.max_blocked, blocked)
+            if beat == reported_beat:
+                continue
+            # Only report each stall once, using the stack from when it crossed the threshold
+            reported_beat = beat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)
+            site = call_site(stack)
+            if site not in self.call_sites:
+                # Exported as ranobot_loop_call_site_stalls_total{name="<site>"}. There are only ever a handful of them
+                register_stats("loop", site, lambda site=site: {"call_site_stalls": self.call_sites[site]}, counters=("call_site_stalls",))
+            self.stalls += 1
+            self.call_sites[site] += 1
+            logger.warning(f"Event loop blocked for over {blocked * 1000:.0f}ms at {site}\n{''.join(stack.format())}")
+
+    def stats(self):
+        return {
+            "stalls": self.stalls,
+            "max_blocked_seconds": self.max_blocked
+        }
+
+    def top_call_sites(self, n=10):
+        return self.call_sites.most_common(n)
+
+
+def call_site(stack):
+    # The deepest frame that belongs to the bot, since that's the call that needs fixing
+    for frame in reversed(stack):
+        if frame.filename.startswith(REPO_DIR) and not frame.filename.endswith("loop_watchdog.py"):
+            return f"{os.path.relpath(frame.filename, REPO_DIR)}:{frame.lineno} in {frame.name}"
+    frame = stack[-1]
+    return f"{frame.filename}:{frame.lineno} in {frame.name}"
+
+def start_watchdog(**kwargs):
+    watchdog = LoopWatchdog(**kwargs)
+    watchdog.start()
+    register_stats("loop", "watchdog", watchdog.stats, counters=("stalls",))
+    return watchdog
@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import asyncio
+import bisect
+import logging
+from collections import deque
+from contextlib import contextmanager
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+####### Metrics Settings #######
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))                     # 0 = no /metrics endpoint
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_LOG_INTERVAL = float(os.getenv("METRICS_LOG_INTERVAL", "0"))   # 0 = no periodic log lines
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+RECENT_SAMPLES = 1024
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    def summary(self):
+        samples = sorted(self.recent)
+        if not samples:
+            return {"count": self.count}
+        return {
+            "count": self.count,
+            "p50_ms": round(samples[len(samples) // 2] * 1000, 2),
+            "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 2),
+            "max_ms": round(samples[-1] * 1000, 2)
+        }
+
+
+_stages = {}
+_histograms = {}
+_stats = []
+_counter_metrics = set()
+startup_phases = {}
+
+
+####### Recording #######
+
+def observe(stage, seconds):
+    hist = _stages.get(stage)
+    if hist is None:
+        hist = _stages[stage] = Histogram()
+    hist.observe(seconds)
+
+@contextmanager
+def span(stage):
+    # Works around awaits too: `with span("stage"): await ...`
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+@contextmanager
+def startup_phase(name):
+    # One-off timings for the phases of bringing the bot up
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_phases[name] = time.perf_counter() - start
+
+def histogram(name):
+    # Histograms that aren't request stages (e.g. event loop lag)
+    hist = _histograms.get(name)
+    if hist is None:
+        hist = _histograms[name] = Histogram()
+    return hist
+
+def register_stats(kind, name, stats_fn, counters=()):
+    # stats_fn returns a flat dict of numbers, exported as ranobot_<kind>_<key>{name="<name>"} gauges.
+    # The keys in counters only ever go up, and are exported as ranobot_<kind>_<key>_total counters instead
+    counters = frozenset(counters)
+    _stats.append((kind, name, stats_fn, counters))
+    _counter_metrics.update(f"ranobot_{kind}_{key}_total" for key in counters)
+
+
+####### Exposition #######
+
+def _histogram_lines(metric, hist, labels=""):
+    sep = "," if labels else ""
+    lines = []
+    cumulative = 0
+    for bound, count in zip(hist.buckets, hist.counts):
+        cumulative += count
+        lines.append(f'{metric}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+    lines.append(f'{metric}_bucket{{{labels}{sep}le="+Inf"}} {hist.count}')
+    suffix = f"{{{labels}}}" if labels else ""
+    lines.append(f"{metric}_sum{suffix} {hist.sum}")
+    lines.append(f"{metric}_count{suffix} {hist.count}")
+    return lines
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def collect_stats():
+    collected = {}
+    for kind, name, stats_fn, counters in _stats:
+        try:
+            stats = stats_fn()
+        except Exception:
+            logger.warning(f"Collecting {kind} stats for {name} failed", exc_info=True)
+            continue
+        for key, value in stats.items():
+            if isinstance(value, (int, float)):
+                metric = f"ranobot_{kind}_{key}_total" if key in counters else f"ranobot_{kind}_{key}"
+                collected.setdefault(metric, []).append((name, value))
+    return collected
+
+def render_prometheus():
+    lines = [
+        "# HELP ranobot_stage_seconds Time spent in each stage of handling a request",
+        "# TYPE ranobot_stage_seconds histogram"
+    ]
+    for stage, hist in sorted(_stages.items()):
+        lines.extend(_histogram_lines("ranobot_stage_seconds", hist, f'stage="{stage}"'))
+    for name, hist in sorted(_histograms.items()):
+        lines.append(f"# TYPE ranobot_{name} histogram")
+        lines.extend(_histogram_lines(f"ranobot_{name}", hist))
+    for metric, values in sorted(collect_stats().items()):
+        lines.append(f"# TYPE {metric} {'counter' if metric in _counter_metrics else 'gauge'}")
+        for name, value in values:
+            lines.append(f'{metric}{{name="{_label(name)}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+def snapshot():
+    return {
+        "stages": {stage: hist.summary() for stage, hist in sorted(_stages.items())},
+        "histograms": {name: hist.summary() for name, hist in sorted(_histograms.items())},
+        "stats": {f"{kind}.{name}": stats_fn() for kind, name, stats_fn, _ in _stats}
+    }
+
+
+####### Server and Logger #######
+
+async def _metrics_handler(request):
+    return web.Response(text=render_prometheus(), content_type="text/plain", charset="utf-8")
+
+async def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
+
+async def metrics_log_loop(interval=METRICS_LOG_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            logger.info(json.dumps({"event": "metrics", **snapshot()}, default=str))
+        except Exception:
+            logger.warning("Logging metrics failed", exc_info=True)
@@ -0,0 +1,126 @@
+import os
+import time
+import random
+from array import array
+from metrics import register_stats
+
+####### Popularity Settings #######
+
+POPULARITY_HALF_LIFE = float(os.getenv("POPULARITY_HALF_LIFE", "21600"))     # seconds for a lookup to count half as much
+POPULARITY_SKETCH_WIDTH = int(os.getenv("POPULARITY_SKETCH_WIDTH", "2048"))
+POPULARITY_SKETCH_DEPTH = int(os.getenv("POPULARITY_SKETCH_DEPTH", "4"))
+POPULARITY_CANDIDATES = int(os.getenv("POPULARITY_CANDIDATES", "256"))       # heavy hitter candidates kept per tracker
+
+# Weights are rescaled back to 1 before they get anywhere near float trouble
+RESCALE_AT = 2.0 ** 32
+
+
+class DecayingCountMin:
+    # Count-min sketch where every count halves each half_life seconds. Instead of decaying all the
+    # counters, newer hits get a bigger weight (forward decay), so estimates are count / current weight.
+    # Memory is fixed at depth * width doubles no matter how many keys go through it
+    def __init__(self, width=POPULARITY_SKETCH_WIDTH, depth=POPULARITY_SKETCH_DEPTH, half_life=POPULARITY_HALF_LIFE):
+        self.width = width
+        self.half_life = half_life
+        self.rows = [array("d", bytes(8 * width)) for _ in range(depth)]
+        self.seeds = [random.getrandbits(64) for _ in range(depth)]
+        self.epoch = time.monotonic()
+
+    def weight(self, now=None):
+        return 2.0 ** (((now or time.monotonic()) - self.epoch) / self.half_life)
+
+    def _indexes(self, key):
+        return [hash((seed, key)) % self.width for seed in self.seeds]
+
+    def add(self, key, now=None):
+        # Returns the raw (undivided) count, which stays comparable between keys until the next rescale
+        now = now or time.monotonic()
+        weight = self.weight(now)
+        indexes = self._indexes(key)
+        # Conservative update: only counters below the new estimate are raised, which keeps collisions from inflating it
+        count = min(row[i] for row, i in zip(self.rows, indexes)) + weight
+        for row, i in zip(self.rows, indexes):
+            if row[i] < count:
+                row[i] = count
+        return count
+
+    def raw(self, key):
+        return min(row[i] for row, i in zip(self.rows, self._indexes(key)))
+
+    def estimate(self, key, now=None):
+        return self.raw(key) / self.weight(now)
+
+    def needs_rescale(self, now=None):
+        return self.weight(now) > RESCALE_AT
+
+    def rescale(self, now=None):
+        # Moves the epoch to now. Returns the factor raw counts got multiplied with
+        now = now or time.monotonic()
+        factor = 1.0 / self.weight(now)
+        for row in self.rows:
+            for i in range(self.width):
+                row[i] *= factor
+        self.epoch = now
+        return factor
+
+class PopularityTracker:
+    # The sketch estimates how often any key was looked up lately. The keys with the biggest
+    # estimates are kept on the side (with whatever is needed to look them up again), since a sketch can't list its keys
+    COUNTERS = ("records", "replaced")
+
+    def __init__(self, name, capacity=POPULARITY_CANDIDATES, **sketch_kwargs):
+        self.name = name
+        self.capacity = capacity
+        self.sketch = DecayingCountMin(**sketch_kwargs)
+        self.candidates = {}        # key -> [raw count, payload]
+        self.records = 0
+        self.replaced = 0
+
+    def __len__(self):
+        return len(self.candidates)
+
+    def record(self, key, payload=None, now=None):
+        now = now or time.monotonic()
+        self.records += 1
+        if self.sketch.needs_rescale(now):
+            factor = self.sketch.rescale(now)
+            for candidate in self.candidates.values():
+                candidate[0] *= factor
+        count = self.sketch.add(key, now)
+        candidate = self.candidates.get(key)
+        if candidate is not None:
+            candidate[0] = count
+            candidate[1] = payload
+        elif len(self.candidates) < self.capacity:
+            self.candidates[key] = [count, payload]
+        else:
+            coldest = min(self.candidates, key=lambda k: self.candidates[k][0])
+            if count > self.candidates[coldest][0]:
+                del self.candidates[coldest]
+                self.candidates[key] = [count, payload]
+                self.replaced += 1
+
+    def estimate(self, key, now=None):
+        return self.sketch.estimate(key, now)
+
+    def top(self, k, now=None):
+        # [(key, decayed lookups, payload)], most popular first
+        weight = self.sketch.weight(now)
+        hottest = sorted(self.candidates.items(), key=lambda item: item[1][0], reverse=True)[:k]
+        return [(key, count / weight, payload) for key, (count, payload) in hottest]
+
+    def stats(self):
+        top = self.top(1)
+        return {
+            "records": self.records,
+            "candidates": len(self.candidates),
+            "replaced": self.replaced,
+            "top_score": top[0][1] if top else 0.0
+        }
+
+
+series_popularity = PopularityTracker("series")
+query_popularity = PopularityTracker("query")
+
+register_stats("popularity", "series", series_popularity.stats, counters=PopularityTracker.COUNTERS)
+register_stats("popularity", "query", query_popularity.stats, counters=PopularityTracker.COUNTERS)
@@ -0,0 +1,239 @@
+# The bot, its commands and its services. Started by bot.py once logging and the environment are set up
+import time
+BOOT_STARTED = time.perf_counter()
+
+import os
+import json
+import asyncio
+import hashlib
+import importlib
+import logging
+import discord
+from discord import Option
+from discord.ext import commands, pages
+from cluster import CLUSTER_ID, SHARD_COUNT, SHARD_IDS, IS_PRIMARY, health_loop, load as cluster_load
+from bot_utils import fetch_series_info, search_series, warm_caches, title_index_loop, LazySearchResults, fetch_comparison
+from bot_ext import GraphButtonView, LazyResultsPaginator, create_results_page, title_autocomplete
+from http_client import get_session, close_session
+from render_pool import start_pool, shutdown_pool, warm_cache as warm_graph_cache, render_comparison, RendererBusy, RenderTimeout, GRAPH_FILENAME
+from store import cache_store
+from title_index import TITLE_INDEX_ENABLED
+from metrics import span, startup_phase, startup_phases, register_stats, start_metrics_server, metrics_log_loop, METRICS_PORT, METRICS_LOG_INTERVAL
+from loop_watchdog import start_watchdog, LOOP_WATCHDOG
+from warmer import hot_warm_loop, HOT_WARM_INTERVAL
+from watchlist import open_watchlist, watch_series, unwatch_series, watched_autocomplete, watch_poll_loop
+
+logger = logging.getLogger(__name__)
+
+# 1 = push the slash commands to Discord on every start, instead of only when their definitions changed
+FORCE_COMMAND_SYNC = os.getenv("FORCE_COMMAND_SYNC", "0") == "1"
+# Modules the first request would otherwise have to import, loaded in the background once the bot is up
+PRELOAD_MODULES = ("release_stats",)
+
+startup_phases["imports"] = time.perf_counter() - BOOT_STARTED
+register_stats("startup", "phases", lambda: {f"{name}_seconds": seconds for name, seconds in startup_phases.items()})
+
+# A sharded bot runs the shards given to this process by the cluster launcher (or all of them)
+BotBase = commands.AutoShardedBot if SHARD_COUNT else commands.Bot
+
+#Bot
+class Ranobot(BotBase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.services_started = False
+        self.background_tasks = []
+        self.metrics_runner = None
+        self.watchdog = None
+
+    async def close(self):
+        for task in self.background_tasks:
+            task.cancel()
+        if self.watchdog is not None:
+            self.watchdog.stop()
+        if self.metrics_runner is not None:
+            await self.metrics_runner.cleanup()
+        await super().close()
+        await close_session()
+        shutdown_pool()
+        if cache_store is not None:
+            await cache_store.close()
+
+    async def start_services(self):
+        # on_ready fires again on every reconnect, so only do this once
+        if self.services_started:
+            return
+        self.services_started = True
+        startup_phases["connect"] = time.perf_counter() - BOOT_STARTED - startup_phases["imports"]
+        if LOOP_WATCHDOG:
+            self.watchdog = start_watchdog()
+        with startup_phase("http_session"):
+            await get_session()
+        with startup_phase("render_pool"):
+            start_pool()
+        if cache_store is not None:
+            with startup_phase("cache_db"):
+                await cache_store.open(compact=IS_PRIMARY)
+                await open_watchlist()
+        if IS_PRIMARY:
+            with startup_phase("command_sync"):
+                await self.sync_commands_if_changed()
+        if cache_store is not None:
+            with startup_phase("warm_caches"):
+                await warm_caches()
+                await warm_graph_cache()
+        if TITLE_INDEX_ENABLED:
+            self.background_tasks.append(asyncio.create_task(title_index_loop(refresh=IS_PRIMARY)))
+        if cache_store is not None:
+            self.background_tasks.append(asyncio.create_task(health_loop(self)))
+            if IS_PRIMARY:
+                self.background_tasks.append(asyncio.create_task(watch_poll_loop(self)))
+        if HOT_WARM_INTERVAL:
+            self.background_tasks.append(asyncio.create_task(hot_warm_loop()))
+        if METRICS_PORT:
+            self.metrics_runner = await start_metrics_server()
+        if METRICS_LOG_INTERVAL:
+            self.background_tasks.append(asyncio.create_task(metrics_log_loop()))
+        self.background_tasks.append(asyncio.create_task(preload_modules()))
+        startup_phases["total"] = time.perf_counter() - BOOT_STARTED
+        logger.info("Startup took " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in startup_phases.items()))
+
+    def command_hash(self):
+        commands = sorted((cmd.to_dict() for cmd in self.pending_application_commands), key=lambda c: c["name"])
+        return hashlib.sha256(json.dumps(commands, sort_keys=True).encode("utf-8")).hexdigest()
+
+    async def sync_commands_if_changed(self):
+        # Syncing costs several API calls and counts against Discord's command rate limits, so it's
+        # skipped when the commands are the same as at the last sync. Dispatch works either way,
+        # since unknown command ids are matched by name
+        digest = self.command_hash()
+        key = f"command_hash:{self.user.id}"
+        if cache_store is not None and not FORCE_COMMAND_SYNC:
+            stored = await cache_store.get("meta", key)
+            if stored == digest.encode("utf-8"):
+                logger.info("Slash commands unchanged since the last sync, skipping it")
+                return
+        await self.sync_commands()
+        if cache_store is not None:
+            await cache_store.set("meta", key, digest.encode("utf-8"))
+        logger.info(f"Synced {len(self.pending_application_commands)} slash commands")
+
+async def preload_modules():
+    for name in PRELOAD_MODULES:
+        await asyncio.to_thread(importlib.import_module, name)
+
+intents = discord.Intents.default()
+# Commands are synced from start_services instead of on every connect
+shard_kwargs = {"shard_ids": SHARD_IDS, "shard_count": SHARD_COUNT} if SHARD_COUNT else {}
+bot = Ranobot(command_prefix="!?", intents=intents, auto_sync_commands=False, **shard_kwargs)
+
+@bot.event
+async def on_ready():
+    await bot.start_services()
+    logger.info(f"{bot.user} is Online")
+    logger.info(f"Connected to {len(bot.guilds)} servers")
+    if SHARD_COUNT:
+        logger.info(f"Cluster {CLUSTER_ID} is running shards {sorted(bot.shards)} of {SHARD_COUNT}")
+
+@bot.listen("on_interaction")
+async def count_interaction(interaction):
+    cluster_load["interactions"] += 1
+
+
+@bot.slash_command(name="search", description="Searches for Light Novels")
+async def fetch(
+    interaction:discord.Interaction,
+    title: Option(str, "Title", autocomplete=title_autocomplete),
+    sort: Option(str, "Select sorting order", name='sort-by', choices=['Relevance desc', 'Relevance asc', 'Title asc', 'Title desc', 'Release date asc', 'Release date desc'], default='Relevance desc'),
+    licensed: Option(str, 'Filter results based on their license status', name='license-filter', choices=['Both','Licensed','Unlicensed'], default='Both')
+):
+    await interaction.response.defer()
+    try:
+        with span("search_total"):
+            results = await search_series(title, sort, licensed)
+        if results is None:
+            await interaction.followup.send("No results found")
+        elif isinstance(results, str):
+            await interaction.followup.send(results)
+        elif isinstance(results, tuple) and len(results)>2:
+            embed, *graph_args = results
+            button_view = GraphButtonView(*graph_args)
+            with span("followup_send"):
+                await interaction.followup.send(embed=embed, view=button_view)
+        else:
+            count, search_results = results
+            if isinstance(search_results, LazySearchResults):
+                paginator = LazyResultsPaginator(search_results, show_disabled=False, loop_pages=True)
+            else:
+                page_list = create_results_page(count, search_results)
+                paginator = pages.Paginator(pages=page_list, show_disabled=False, loop_pages=True)
+            with span("followup_send"):
+                await paginator.respond(interaction.interaction)
+    except Exception as e:
+        await interaction.followup.send("🚨 An unexpected error occurred.", ephemeral=True)
+        logger.error(f"Error during searching for {title}", exc_info=True)
+
+
+def compare_option(n, required=False):
+    if required:
+        return Option(str, "Title or RanobeDB id", name=f"series-{n}", autocomplete=title_autocomplete)
+    return Option(str, "Title or RanobeDB id", name=f"series-{n}", autocomplete=title_autocomplete, required=False, default=None)
+
+@bot.slash_command(name="compare", description="Compares the release pace of 2 to 8 Light Novels")
+async def compare(
+    interaction:discord.Interaction,
+    series_1: compare_option(1, True),
+    series_2: compare_option(2, True),
+    series_3: compare_option(3),
+    series_4: compare_option(4),
+    series_5: compare_option(5),
+    series_6: compare_option(6),
+    series_7: compare_option(7),
+    series_8: compare_option(8)
+):
+    await interaction.response.defer()
+    queries = [q for q in (series_1, series_2, series_3, series_4, series_5, series_6, series_7, series_8) if q and q.strip()]
+    try:
+        with span("compare_total"):
+            series, missing = await fetch_comparison(queries)
+            if len(series) < 2:
+                await interaction.followup.send("Need at least two different series to compare." + (f"\nNothing found for: {', '.join(missing)}" if missing else ""))
+                return
+            buf = await render_comparison(series)
+        content = f"Nothing found for: {', '.join(missing)}" if missing else None
+        with span("followup_send"):
+            await interaction.followup.send(content=content, file=discord.File(buf, filename=GRAPH_FILENAME))
+    except RendererBusy:
+        await interaction.followup.send("⏳ Too many graphs are being generated right now. Please try again in a bit.", ephemeral=True)
+        logger.warning(f"Graph renderer is saturated. Rejected comparison of {queries}")
+    except RenderTimeout:
+        await interaction.followup.send("⌛ The graph took too long to generate. Please try again later.", ephemeral=True)
+        logger.warning(f"Comparison graph timed out for {queries}")
+    except Exception as e:
+        await interaction.followup.send("🚨 An unexpected error occurred.", ephemeral=True)
+        logger.error(f"Error during comparison of {queries}", exc_info=True)
+
+@bot.slash_command(name="watch", description="Get pinged in this channel when a Light Novel gets a new volume")
+async def watch(
+    interaction:discord.Interaction,
+    title: Option(str, "Title or RanobeDB id", autocomplete=title_autocomplete)
+):
+    await interaction.response.defer(ephemeral=True)
+    try:
+        message = await watch_series(title, interaction.channel_id, interaction.user.id)
+        await interaction.followup.send(message, ephemeral=True)
+    except Exception as e:
+        await interaction.followup.send("🚨 An unexpected error occurred.", ephemeral=True)
+        logger.error(f"Error during watching {title}", exc_info=True)
+
+@bot.slash_command(name="unwatch", description="Stop getting pinged about a Light Novel in this channel")
+async def unwatch(
+    interaction:discord.Interaction,
+    title: Option(str, "One of the series you watch here", autocomplete=watched_autocomplete)
+):
+    await interaction.response.defer(ephemeral=True)
+    try:
+        message = await unwatch_series(title, interaction.channel_id, interaction.user.id)
+        await interaction.followup.send(message, ephemeral=True)
+    except Exception as e:
+        await interaction.followup.send("🚨 An unexpected error occurred.", ephemeral=True)
+        logger.error(f"Error during unwatching {title}", exc_info=True)
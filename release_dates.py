@@ -0,0 +1,40 @@
+import bisect
+from array import array
+from datetime import date
+from collections.abc import Mapping
+
+
+class ReleaseDates(Mapping):
+    # Volume sort order -> release date. Kept as two int arrays (sort orders and date ordinals)
+    # rather than a dict of date objects, since every graph button holds on to one
+    __slots__ = ("orders", "ordinals")
+
+    def __init__(self, orders=(), ordinals=()):
+        self.orders = array("i", orders)
+        self.ordinals = array("i", ordinals)
+
+    def __getitem__(self, sort_order):
+        i = bisect.bisect_left(self.orders, sort_order)
+        if i == len(self.orders) or self.orders[i] != sort_order:
+            raise KeyError(sort_order)
+        return date.fromordinal(self.ordinals[i])
+
+    def __iter__(self):
+        return iter(self.orders)
+
+    def __len__(self):
+        return len(self.orders)
+
+    def __reduce__(self):
+        return (ReleaseDates, (self.orders, self.ordinals))
+
+    def __repr__(self):
+        return f"ReleaseDates({dict(self.items())!r})"
+
+    @classmethod
+    def from_dates(cls, dates):
+        # From any volume -> date mapping
+        if isinstance(dates, cls):
+            return dates
+        items = sorted(dates.items())
+        return cls([vol for vol, _ in items], [d.toordinal() for _, d in items])
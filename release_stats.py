@@ -0,0 +1,96 @@
+import os
+import numpy as np
+from dataclasses import dataclass
+from datetime import date
+from typing import Optional
+from release_dates import ReleaseDates
+
+# How many of the latest gaps between volumes the next release estimate is based on
+PREDICTION_RECENT_GAPS = int(os.getenv("PREDICTION_RECENT_GAPS", "8"))
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+DAYS_PER_MONTH = 30.44
+
+
+####### Misc Functions #######
+
+def ordinal_array(release_dates):
+    # ReleaseDates keeps its ordinals in an int array, which numpy can use without copying
+    return np.frombuffer(release_dates.ordinals, dtype=np.int32).astype(np.int64) if len(release_dates) else np.empty(0, dtype=np.int64)
+
+def month_index(ordinals):
+    # Months since 1970, so that month gaps match months_between_vols
+    return (ordinals - EPOCH_ORDINAL).astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+
+def to_date(ordinal):
+    return date.fromordinal(ordinal) if ordinal is not None else None
+
+
+######## Data Classes ########
+
+@dataclass(slots=True)
+class Cadence:
+    volumes: int
+    latest: Optional[int] = None            # date ordinals from here on
+    avg_gap_months: float = 0.0
+    mean_gap_days: float = 0.0
+    median_gap_days: float = 0.0
+    next_expected: Optional[int] = None     # None with fewer than two volumes
+    next_low: Optional[int] = None
+    next_high: Optional[int] = None
+
+    def next_release(self, today=None):
+        # (expected, low, high) as dates. An overdue estimate is moved to today
+        if self.next_expected is None:
+            return None
+        today = (today or date.today()).toordinal()
+        return tuple(date.fromordinal(max(o, today)) for o in (self.next_expected, self.next_low, self.next_high))
+
+@dataclass(slots=True)
+class ReleaseStats:
+    jp: Cadence
+    en: Cadence
+    lag_days: np.ndarray                    # EN release minus JP release, for every volume released in both
+    median_lag_days: Optional[float] = None
+
+    @property
+    def median_lag_months(self):
+        return self.median_lag_days / DAYS_PER_MONTH if self.median_lag_days is not None else None
+
+
+####### Statistics #######
+
+def cadence(release_dates):
+    ordinals = ordinal_array(release_dates)
+    if len(ordinals) < 2:
+        return Cadence(len(ordinals), int(ordinals[-1]) if len(ordinals) else None)
+    gaps = np.diff(ordinals)
+    month_gaps = np.diff(month_index(ordinals))
+    # The median and quartiles of the recent gaps, so one long hiatus doesn't throw the estimate off
+    recent = gaps[-PREDICTION_RECENT_GAPS:]
+    low, median, high = np.percentile(recent, [25, 50, 75])
+    latest = int(ordinals[-1])
+    return Cadence(
+        volumes=len(ordinals),
+        latest=latest,
+        avg_gap_months=float(month_gaps.mean()),
+        mean_gap_days=float(gaps.mean()),
+        median_gap_days=float(np.median(gaps)),
+        next_expected=latest + int(round(median)),
+        next_low=latest + int(round(low)),
+        next_high=latest + int(round(high))
+    )
+
+def compute_release_stats(vol_rel_dates_jp, vol_rel_dates_en):
+    vol_rel_dates_jp = ReleaseDates.from_dates(vol_rel_dates_jp)
+    vol_rel_dates_en = ReleaseDates.from_dates(vol_rel_dates_en)
+    jp_orders = np.frombuffer(vol_rel_dates_jp.orders, dtype=np.int32) if len(vol_rel_dates_jp) else np.empty(0, dtype=np.int32)
+    en_orders = np.frombuffer(vol_rel_dates_en.orders, dtype=np.int32) if len(vol_rel_dates_en) else np.empty(0, dtype=np.int32)
+    _, jp_index, en_index = np.intersect1d(jp_orders, en_orders, assume_unique=True, return_indices=True)
+    lag_days = (ordinal_array(vol_rel_dates_en)[en_index] - ordinal_array(vol_rel_dates_jp)[jp_index]).astype(np.int32)
+    return ReleaseStats(
+        jp=cadence(vol_rel_dates_jp),
+        en=cadence(vol_rel_dates_en),
+        lag_days=lag_days,
+        median_lag_days=float(np.median(lag_days)) if len(lag_days) else None
+    )
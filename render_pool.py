@@ -0,0 +1,296 @@
+import os
+import io
+import time
+import hashlib
+import asyncio
+import logging
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timedelta
+from cache import TTLCache
+from singleflight import SingleFlight
+from store import cache_store
+from metrics import observe, span, register_stats
+
+logger = logging.getLogger(__name__)
+
+####### Renderer Settings #######
+
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "2"))
+RENDER_QUEUE_SIZE = int(os.getenv("RENDER_QUEUE_SIZE", "8"))    # jobs running + waiting for a worker
+RENDER_TIMEOUT = float(os.getenv("RENDER_TIMEOUT", "30"))
+GRAPH_CACHE_MAX_MB = float(os.getenv("GRAPH_CACHE_MAX_MB", "128"))
+GRAPH_ENGINE = os.getenv("GRAPH_ENGINE", "template")        # template (reuses one figure per worker) or classic
+GRAPH_PROFILE = os.getenv("GRAPH_PROFILE", "standard")
+GRAPH_MAX_KB = float(os.getenv("GRAPH_MAX_KB", "0"))         # overrides the profile's byte budget, 0 = keep it
+SPECULATIVE_RENDER = os.getenv("SPECULATIVE_RENDER", "0") == "1"           # render graphs as soon as the embed is shown
+SPECULATIVE_MAX_IN_FLIGHT = int(os.getenv("SPECULATIVE_MAX_IN_FLIGHT", "1"))
+
+# Output profiles. The dpi gets stepped down until the image fits max_bytes
+OUTPUT_PROFILES = {
+    "print": {"format": "png", "dpi": 300, "compress_level": 6, "max_bytes": None},
+    "standard": {"format": "png", "dpi": 150, "compress_level": 6, "max_bytes": 1536 * 1024},
+    "compact": {"format": "webp", "dpi": 150, "quality": 85, "method": 4, "max_bytes": 512 * 1024},
+    "small": {"format": "webp", "dpi": 110, "quality": 75, "method": 4, "max_bytes": 256 * 1024}
+}
+if GRAPH_PROFILE not in OUTPUT_PROFILES:
+    logger.warning(f"Unknown GRAPH_PROFILE '{GRAPH_PROFILE}'. Using 'standard'")
+    GRAPH_PROFILE = "standard"
+output_profile = dict(OUTPUT_PROFILES[GRAPH_PROFILE])
+if GRAPH_MAX_KB > 0:
+    output_profile["max_bytes"] = int(GRAPH_MAX_KB * 1024)
+GRAPH_FILENAME = f"chart.{output_profile['format']}"
+
+_executor: ProcessPoolExecutor | None = None
+_jobs = 0
+_speculative = {}                   # graph key -> speculative render task
+_claimed = set()                    # speculative renders someone clicked for while they were running
+_speculated = OrderedDict()         # graph keys finished by a speculative render and not clicked for yet
+speculation = {
+    "started": 0, "skipped_busy": 0, "skipped_cap": 0, "completed": 0, "cancelled": 0, "failed": 0,
+    "hits": 0, "joined": 0, "cached": 0, "misses": 0
+}
+
+# Keys already contain the render date, so entries never need to expire. Old ones just fall out of the LRU
+graph_cache = TTLCache("graph", ttl=float("inf"), max_entries=100000, max_bytes=int(GRAPH_CACHE_MAX_MB * 1024 * 1024), sizeof=len)
+graph_flight = SingleFlight("graph")
+
+register_stats("cache", "graph", graph_cache.stats, counters=TTLCache.COUNTERS)
+register_stats("singleflight", "graph", graph_flight.stats, counters=SingleFlight.COUNTERS)
+register_stats("render", "pool", lambda: {"queued_jobs": _jobs, "queue_size": RENDER_QUEUE_SIZE, "workers": RENDER_WORKERS})
+register_stats("render", "speculation", lambda: speculation_stats(), counters=speculation)
+
+
+class RendererBusy(Exception):
+    pass
+
+class RenderTimeout(Exception):
+    pass
+
+
+####### Worker Side #######
+# These run inside the worker processes, which is the only place matplotlib gets imported
+
+def _init_worker(engine):
+    import graph
+    from matplotlib import font_manager
+    for font in graph.load_fonts():
+        try:
+            font_manager.get_font(font.get_file())
+        except (OSError, RuntimeError):
+            logging.getLogger(__name__).warning(f"Could not preload font {font.get_file()}")
+    if engine == "template":
+        graph.get_template()
+
+def _warm_up():
+    return os.getpid()
+
+def _render_graph(args, engine, profile):
+    import graph
+    timings = {}
+    buf = graph.render(args, engine, profile, timings)
+    return buf.getvalue(), timings
+
+def _render_comparison(series, profile):
+    import graph
+    timings = {}
+    buf = graph.generate_comparison_graph(series, timings, profile)
+    return buf.getvalue(), timings
+
+
+####### Pool Handling #######
+
+def start_pool():
+    global _executor
+    if _executor is None:
+        # spawn so the workers don't inherit the bot's event loop, sockets and threads
+        _executor = ProcessPoolExecutor(
+            max_workers=RENDER_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(GRAPH_ENGINE,)
+        )
+        for _ in range(RENDER_WORKERS):
+            _executor.submit(_warm_up)
+        logger.info(f"Started graph render pool with {RENDER_WORKERS} workers")
+    return _executor
+
+def shutdown_pool():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+        logger.info("Shut down graph render pool")
+
+def queued_jobs():
+    return _jobs
+
+def _job_finished(_):
+    global _jobs
+    _jobs -= 1
+
+async def submit(fn, *args):
+    # Jobs are counted until the worker is actually done with them, so timed out jobs
+    # that are still running keep taking up space in the queue
+    global _jobs
+    if _jobs >= RENDER_QUEUE_SIZE:
+        raise RendererBusy()
+    loop = asyncio.get_running_loop()
+    try:
+        future = start_pool().submit(fn, *args)
+    except BrokenProcessPool:
+        logger.warning("Graph render pool was broken. Restarting it")
+        shutdown_pool()
+        future = start_pool().submit(fn, *args)
+    _jobs += 1
+    future.add_done_callback(lambda f: loop.call_soon_threadsafe(_job_finished, f))
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), RENDER_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise RenderTimeout() from None
+
+####### Graph Rendering #######
+
+def graph_key(vol_rel_dates_jp, vol_rel_dates_en, predict, title, latest_vol_jp, latest_vol_en, stats=None):
+    # Everything the graph is drawn from, plus today's date for the "today" line and the prediction.
+    # The statistics are worked out from the dates, so they don't need to be part of it
+    parts = (
+        sorted((vol, str(d)) for vol, d in vol_rel_dates_jp.items()),
+        sorted((vol, str(d)) for vol, d in vol_rel_dates_en.items()),
+        bool(predict), title, latest_vol_jp, latest_vol_en,
+        GRAPH_ENGINE, sorted(output_profile.items()),
+        date.today().isoformat()
+    )
+    return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+def seconds_until_tomorrow():
+    now = datetime.now()
+    return (datetime.combine(now.date() + timedelta(days=1), datetime.min.time()) - now).total_seconds()
+
+def comparison_key(series):
+    parts = (
+        "compare",
+        [(title, sorted((vol, str(d)) for vol, d in jp.items()), sorted((vol, str(d)) for vol, d in en.items())) for title, jp, en, _ in series],
+        sorted(output_profile.items()),
+        date.today().isoformat()
+    )
+    return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+async def _load_or_render(key, fn, *job_args):
+    if cache_store is not None:
+        png = await cache_store.get("graph", key)
+        if png is not None:
+            return png
+    png, timings = await submit(fn, *job_args)
+    for stage, seconds in timings.items():
+        observe(stage, seconds)
+    if cache_store is not None:
+        # Tomorrow the same graph gets a new key anyway
+        await cache_store.set("graph", key, png, ttl=seconds_until_tomorrow())
+    return png
+
+async def render_graph(vol_rel_dates_jp, vol_rel_dates_en, predict, title, latest_vol_jp, latest_vol_en, stats=None):
+    args = (vol_rel_dates_jp, vol_rel_dates_en, predict, title, latest_vol_jp, latest_vol_en, stats)
+    key = graph_key(*args)
+    if SPECULATIVE_RENDER:
+        _count_speculation(key)
+    with span("graph_total"):
+        png = await graph_cache.get_or_fetch(key, lambda: graph_flight.do(key, lambda: _load_or_render(key, _render_graph, args, GRAPH_ENGINE, output_profile)))
+    return io.BytesIO(png)
+
+####### Speculative Rendering #######
+# The graph for a series embed is rendered in the background before anyone asks for it, so
+# clicking the button only has to upload it. These only run while a worker is free
+
+def _count_speculation(key):
+    if _speculated.pop(key, None) is not None:
+        speculation["hits"] += 1
+    elif key in _speculative:
+        _claimed.add(key)
+        speculation["joined"] += 1
+    elif key in graph_cache:
+        speculation["cached"] += 1
+    else:
+        speculation["misses"] += 1
+
+def speculate(vol_rel_dates_jp, vol_rel_dates_en, predict, title, latest_vol_jp, latest_vol_en, stats=None):
+    # Returns the graph key if a render was started (or isn't needed), to cancel it with later
+    if not SPECULATIVE_RENDER or len(vol_rel_dates_jp) < 2:
+        return None
+    args = (vol_rel_dates_jp, vol_rel_dates_en, predict, title, latest_vol_jp, latest_vol_en, stats)
+    key = graph_key(*args)
+    if key in _speculative or key in graph_cache or graph_flight.in_flight(key):
+        return None
+    if len(_speculative) >= SPECULATIVE_MAX_IN_FLIGHT:
+        speculation["skipped_cap"] += 1
+        return None
+    if _jobs >= RENDER_WORKERS:
+        speculation["skipped_busy"] += 1
+        return None
+    speculation["started"] += 1
+    task = graph_flight.start(key, lambda: _speculative_render(key, args))
+    _speculative[key] = task
+    task.add_done_callback(lambda t: _speculation_finished(key, t))
+    return key
+
+async def _speculative_render(key, args):
+    png = await _load_or_render(key, _render_graph, args, GRAPH_ENGINE, output_profile)
+    graph_cache.set(key, png)
+    return png
+
+def _speculation_finished(key, task):
+    _speculative.pop(key, None)
+    claimed = key in _claimed
+    _claimed.discard(key)
+    if task.cancelled():
+        speculation["cancelled"] += 1
+    elif task.exception() is not None:
+        speculation["failed"] += 1
+        logger.debug(f"Speculative render failed: {task.exception()!r}")
+    else:
+        speculation["completed"] += 1
+        if not claimed:
+            _speculated[key] = True
+            while len(_speculated) > 1000:
+                _speculated.popitem(last=False)
+
+def cancel_speculation(key):
+    # For when the view timed out. Renders someone is already waiting on are left alone
+    task = _speculative.get(key)
+    if task is not None and key not in _claimed:
+        task.cancel()
+    _speculated.pop(key, None)
+
+def speculation_stats():
+    used = speculation["hits"] + speculation["joined"]
+    clicks = used + speculation["misses"]
+    return {**speculation, "in_flight": len(_speculative), "hit_rate": used / clicks if clicks else 0.0}
+
+async def prerender_graph(vol_rel_dates_jp, vol_rel_dates_en, predict, title, latest_vol_jp, latest_vol_en, stats=None):
+    # For the hot series warmer. Only uses a worker that is free, and returns whether it rendered anything
+    if len(vol_rel_dates_jp) < 2:
+        return False
+    args = (vol_rel_dates_jp, vol_rel_dates_en, predict, title, latest_vol_jp, latest_vol_en, stats)
+    key = graph_key(*args)
+    if key in graph_cache or graph_flight.in_flight(key) or _jobs >= RENDER_WORKERS:
+        return False
+    png = await graph_flight.do(key, lambda: _load_or_render(key, _render_graph, args, GRAPH_ENGINE, output_profile))
+    graph_cache.set(key, png)
+    return True
+
+async def render_comparison(series):
+    # series is a list of (title, vol_rel_dates_jp, vol_rel_dates_en)
+    key = comparison_key(series)
+    with span("compare_graph_total"):
+        png = await graph_cache.get_or_fetch(key, lambda: graph_flight.do(key, lambda: _load_or_render(key, _render_comparison, series, output_profile)))
+    return io.BytesIO(png)
+
+async def warm_cache():
+    if cache_store is None:
+        return
+    rows = await cache_store.hottest("graph")
+    for key, png, _ in rows:
+        graph_cache.set(key, png)
+    logger.info(f"Warmed {len(rows)} graphs from the cache database")
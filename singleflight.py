@@ -0,0 +1,54 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    # Callers asking for a key that is already being worked on wait for that same result
+    # (or exception) instead of starting the work again
+    COUNTERS = ("calls", "executions", "saved")
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.executions = 0
+        self.saved = 0
+        self._inflight = {}
+
+    def __len__(self):
+        return len(self._inflight)
+
+    def start(self, key, fn):
+        # Returns the task for the key, starting it if nothing is working on it yet
+        self.calls += 1
+        task = self._inflight.get(key)
+        if task is not None:
+            self.saved += 1
+        else:
+            self.executions += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finished(key, t))
+        return task
+
+    def in_flight(self, key):
+        return key in self._inflight
+
+    async def do(self, key, fn):
+        # Shielded so one caller giving up doesn't cancel the work for everyone else
+        return await asyncio.shield(self.start(key, fn))
+
+    def _finished(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug(f"[{self.name}] Shared call for {key!r} failed: {task.exception()!r}")
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "executions": self.executions,
+            "saved": self.saved,
+            "in_flight": len(self._inflight)
+        }
@@ -0,0 +1,221 @@
+import os
+import time
+import asyncio
+import sqlite3
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from metrics import register_stats
+
+logger = logging.getLogger(__name__)
+
+####### Store Settings #######
+
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "./cache/ranobot.db")       # empty = no persistent cache
+CACHE_DB_MAX_MB = float(os.getenv("CACHE_DB_MAX_MB", "512"))
+CACHE_DB_COMPACT_INTERVAL = float(os.getenv("CACHE_DB_COMPACT_INTERVAL", "600"))
+WARM_START_ENTRIES = int(os.getenv("WARM_START_ENTRIES", "200"))         # per namespace
+
+# Only these are dropped to stay under CACHE_DB_MAX_MB. The rest (the title index snapshot, the
+# command hash, health reports) is small, and losing it costs far more than it saves
+CACHE_NAMESPACES = ("series", "search", "graph")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL,
+    accessed_at REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at);
+CREATE INDEX IF NOT EXISTS entries_hits ON entries (namespace, hits);
+"""
+
+
+class SQLiteStore:
+    # On-disk cache tier shared by everything that wants its data to survive a restart.
+    # All queries run on one dedicated thread so the event loop never waits on disk I/O
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-store")
+        self._compact_task = None
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    ### Runs on the store thread ###
+
+    def _open(self):
+        if self._conn is not None:
+            return self._conn
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.executescript(SCHEMA)
+        self._conn = conn
+        return conn
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _get(self, namespace, key):
+        conn = self._open()
+        now = time.time()
+        row = conn.execute(
+            "SELECT value, expires_at FROM entries WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, key, now)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        conn.execute(
+            "UPDATE entries SET accessed_at = ?, hits = hits + 1 WHERE namespace = ? AND key = ?",
+            (now, namespace, key)
+        )
+        self.hits += 1
+        return row
+
+    def _set(self, namespace, key, value, ttl):
+        conn = self._open()
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        conn.execute(
+            """INSERT INTO entries (namespace, key, value, size, expires_at, accessed_at, hits) VALUES (?, ?, ?, ?, ?, ?, 0)
+               ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, size = excluded.size,
+               expires_at = excluded.expires_at, accessed_at = excluded.accessed_at""",
+            (namespace, key, value, len(value), expires_at, now)
+        )
+
+    def _delete(self, namespace, key):
+        conn = self._open()
+        conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def _hottest(self, namespace, limit):
+        conn = self._open()
+        return conn.execute(
+            """SELECT key, value, expires_at FROM entries WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?)
+               ORDER BY hits DESC, accessed_at DESC LIMIT ?""",
+            (namespace, time.time(), limit)
+        ).fetchall()
+
+    def _items(self, namespace):
+        conn = self._open()
+        return conn.execute(
+            "SELECT key, value, expires_at FROM entries WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?) ORDER BY key",
+            (namespace, time.time())
+        ).fetchall()
+
+    def _compact(self):
+        conn = self._open()
+        expired = conn.execute("DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)).rowcount
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        evicted = 0
+        if total > self.max_bytes:
+            # Drop the least recently used cache entries until we're back under the cap
+            rows = conn.execute(
+                f"SELECT namespace, key, size FROM entries WHERE namespace IN ({', '.join('?' * len(CACHE_NAMESPACES))}) ORDER BY accessed_at",
+                CACHE_NAMESPACES
+            ).fetchall()
+            doomed = []
+            for namespace, key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                doomed.append((namespace, key))
+                total -= size
+            conn.executemany("DELETE FROM entries WHERE namespace = ? AND key = ?", doomed)
+            evicted = len(doomed)
+            self.evictions += evicted
+        if expired or evicted:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.execute("PRAGMA incremental_vacuum")
+        return expired, evicted, total
+
+    def _stats(self):
+        conn = self._open()
+        entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {"entries": entries, "bytes": size, "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    ### Used from the event loop ###
+
+    async def open(self, compact=True):
+        # In cluster mode several processes share the database, and only one of them compacts it
+        await self._run(self._open)
+        if compact and self._compact_task is None:
+            self._compact_task = asyncio.create_task(self._compact_loop())
+        logger.info(f"Opened cache database at {self.path}")
+
+    async def close(self):
+        if self._compact_task is not None:
+            self._compact_task.cancel()
+            self._compact_task = None
+        await self._run(self._close)
+        self._executor.shutdown(wait=False)
+
+    async def run(self, fn, *args):
+        # For modules with tables of their own: fn(conn, *args) runs on the store thread
+        return await self._run(lambda: fn(self._open(), *args))
+
+    async def get(self, namespace, key):
+        entry = await self.get_entry(namespace, key)
+        return entry[0] if entry is not None else None
+
+    async def get_entry(self, namespace, key):
+        # (value, expires_at) or None. A broken cache database should only ever cost us a cache miss
+        try:
+            return await self._run(self._get, namespace, str(key))
+        except sqlite3.Error:
+            logger.error(f"Cache database read failed for {namespace}/{key}", exc_info=True)
+            return None
+
+    async def set(self, namespace, key, value, ttl=None):
+        try:
+            await self._run(self._set, namespace, str(key), value, ttl)
+        except sqlite3.Error:
+            logger.error(f"Cache database write failed for {namespace}/{key}", exc_info=True)
+
+    async def delete(self, namespace, key):
+        await self._run(self._delete, namespace, str(key))
+
+    async def hottest(self, namespace, limit=WARM_START_ENTRIES):
+        return await self._run(self._hottest, namespace, limit)
+
+    async def items(self, namespace):
+        return await self._run(self._items, namespace)
+
+    async def compact(self):
+        expired, evicted, total = await self._run(self._compact)
+        if expired or evicted:
+            logger.info(f"Compacted cache database: {expired} expired, {evicted} evicted, {total} bytes left")
+
+    async def stats(self):
+        return await self._run(self._stats)
+
+    async def _compact_loop(self):
+        while True:
+            try:
+                await self.compact()
+            except sqlite3.Error:
+                logger.error("Cache database compaction failed", exc_info=True)
+            await asyncio.sleep(CACHE_DB_COMPACT_INTERVAL)
+
+
+cache_store = SQLiteStore(CACHE_DB_PATH, int(CACHE_DB_MAX_MB * 1024 * 1024)) if CACHE_DB_PATH else None
+
+if cache_store is not None:
+    register_stats("store", "sqlite", lambda: {"hits": cache_store.hits, "misses": cache_store.misses, "evictions": cache_store.evictions},
+                   counters=("hits", "misses", "evictions"))
@@ -0,0 +1,41 @@
+import pytest
+from matplotlib import font_manager
+import graph
+from bot_utils import build_series_info
+from benchmarks.fixtures import synthetic_series
+
+pytestmark = pytest.mark.filterwarnings("ignore:Glyph .* missing from font")
+
+
+@pytest.fixture(autouse=True)
+def default_fonts(monkeypatch):
+    # The CJK fonts aren't part of the repository, and the default font is fine for these checks
+    monkeypatch.setattr(graph, "_fonts", (font_manager.FontProperties(), font_manager.FontProperties()))
+
+@pytest.fixture
+def template():
+    return graph.GraphTemplate()
+
+def test_template_rescales_y_axis_between_renders(template):
+    small = build_series_info(synthetic_series(1005))[1:]
+    large = build_series_info(synthetic_series(1060))[1:]
+    limits = []
+    for args in (small, large, small):
+        template.render(*args)
+        limits.append(template.ax.get_ylim())
+
+    assert limits[0][0] == limits[1][0] == 0
+    assert 5 <= limits[0][1] < 10
+    assert limits[1][1] >= 60
+    assert limits[2] == limits[0]
+
+def test_comparison_uses_the_cached_stats(monkeypatch):
+    series = []
+    for series_id in (1005, 1060):
+        embed, jp, en, *_, stats = build_series_info(synthetic_series(series_id))
+        series.append((embed.title, jp, en, stats))
+
+    def recompute(*args):
+        raise AssertionError("release stats were computed again")
+    monkeypatch.setattr(graph, "compute_release_stats", recompute)
+    assert graph.generate_comparison_graph(series).getbuffer().nbytes > 0
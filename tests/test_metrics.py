@@ -0,0 +1,18 @@
+from metrics import register_stats, collect_stats, render_prometheus
+
+
+def test_counters_get_total_suffix_and_type():
+    register_stats("test", "example", lambda: {"requests": 3, "in_flight": 1}, counters=("requests",))
+    collected = collect_stats()
+    assert collected["ranobot_test_requests_total"] == [("example", 3)]
+    assert collected["ranobot_test_in_flight"] == [("example", 1)]
+
+    lines = render_prometheus().splitlines()
+    assert "# TYPE ranobot_test_requests_total counter" in lines
+    assert 'ranobot_test_requests_total{name="example"} 3' in lines
+    assert "# TYPE ranobot_test_in_flight gauge" in lines
+    assert 'ranobot_test_in_flight{name="example"} 1' in lines
+
+def test_label_values_are_escaped():
+    register_stats("test_labels", 'bot.py:1 in "quoted"', lambda: {"value": 1})
+    assert 'ranobot_test_labels_value{name="bot.py:1 in \\"quoted\\""} 1' in render_prometheus().splitlines()
@@ -0,0 +1,51 @@
+import pytest
+from popularity import DecayingCountMin, PopularityTracker, RESCALE_AT
+
+
+def test_estimate_halves_every_half_life():
+    sketch = DecayingCountMin(width=256, depth=4, half_life=100)
+    start = sketch.epoch
+    for _ in range(4):
+        sketch.add("overlord", start)
+    assert sketch.estimate("overlord", start) == pytest.approx(4)
+    assert sketch.estimate("overlord", start + 100) == pytest.approx(2)
+    assert sketch.estimate("overlord", start + 200) == pytest.approx(1)
+    assert sketch.estimate("unknown", start) == 0
+
+def test_rescale_keeps_order_and_scores():
+    tracker = PopularityTracker("test", capacity=8, width=256, depth=4, half_life=1)
+    start = tracker.sketch.epoch
+    for key, hits in (("a", 3), ("b", 2), ("c", 1)):
+        for _ in range(hits):
+            tracker.record(key, payload=key.upper(), now=start)
+    later = start + 40    # weight 2**40, past the rescale threshold
+    assert tracker.sketch.needs_rescale(later)
+    before = tracker.top(3, now=later)
+
+    tracker.record("d", now=later)
+
+    assert tracker.sketch.epoch == later
+    assert tracker.sketch.weight(later) == 1.0 < RESCALE_AT
+    after = [item for item in tracker.top(4, now=later) if item[0] != "d"]
+    assert [key for key, _, _ in after] == ["a", "b", "c"]
+    assert [payload for _, _, payload in after] == ["A", "B", "C"]
+    for (_, old_score, _), (_, new_score, _) in zip(before, after):
+        assert new_score == pytest.approx(old_score, rel=1e-9)
+    assert tracker.estimate("a", later) == pytest.approx(before[0][1], rel=1e-9)
+
+def test_hot_key_replaces_coldest_candidate_when_full():
+    tracker = PopularityTracker("test", capacity=2, width=1024, depth=4, half_life=1000)
+    now = tracker.sketch.epoch
+    tracker.record("cold", now=now)
+    for _ in range(3):
+        tracker.record("warm", now=now)
+    assert len(tracker) == 2
+
+    # One lookup isn't more than the coldest candidate has, a second one is
+    tracker.record("hot", now=now)
+    assert "hot" not in tracker.candidates
+    tracker.record("hot", now=now)
+
+    assert set(tracker.candidates) == {"warm", "hot"}
+    assert tracker.replaced == 1
+    assert [key for key, _, _ in tracker.top(2, now=now)] == ["warm", "hot"]
@@ -0,0 +1,32 @@
+import pytest
+import bot_utils
+from title_index import TitleIndex
+
+
+@pytest.fixture
+def index(monkeypatch):
+    index = TitleIndex()
+    index.add_many([
+        {"id": 1, "lang": "en", "title": "Overlord", "romaji": "Overlord"},
+        {"id": 2, "lang": "ja", "title": "Only Sense Online", "romaji": "Only Sense Online"},
+        {"id": 3, "lang": "ja", "title": "Twin Title", "romaji": "Twin Title"},
+        {"id": 4, "lang": "en", "title": "Twin Title", "romaji": "Twin Title"},
+    ])
+    monkeypatch.setattr(bot_utils, "title_index", index)
+    monkeypatch.setattr(bot_utils, "TITLE_INDEX_ENABLED", True)
+    return index
+
+
+@pytest.mark.parametrize("title, licensed, expected", [
+    ("id:42", "Both", 42),
+    ("id:42", "Licensed", 42),
+    ("overlord", "Both", 1),
+    ("overlord", "Licensed", None),
+    ("Only Sense Online", "Unlicensed", None),
+    ("twin title", "Both", None),
+    ("over", "Both", None),
+    ("id:abc", "Both", None),
+], ids=["picked", "picked with filter", "exact title", "exact title with filter", "exact title with other filter",
+        "ambiguous title", "prefix only", "not an id"])
+def test_shortcut_series_id(index, title, licensed, expected):
+    assert bot_utils.shortcut_series_id(title, licensed) == expected
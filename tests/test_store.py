@@ -0,0 +1,51 @@
+import time
+import asyncio
+import pytest
+from store import SQLiteStore
+from cache import TTLCache, Expiring
+
+
+def test_size_cap_only_evicts_cache_namespaces(tmp_path):
+    async def run():
+        store = SQLiteStore(str(tmp_path / "cache.db"), max_bytes=4096)
+        await store.open(compact=False)
+        await store.set("index", "titles", b"t" * 2048)
+        await store.set("meta", "command_hash:1", b"m" * 64)
+        await store.set("health", "0", b"h" * 512, ttl=60)
+        for i in range(10):
+            await store.set("series", i, b"s" * 1024, ttl=3600)
+        await store.compact()
+        kept = {namespace: [key for key, _, _ in await store.items(namespace)] for namespace in ("index", "meta", "health", "series")}
+        await store.close()
+        return kept
+
+    kept = asyncio.run(run())
+    assert kept["index"] == ["titles"]
+    assert kept["meta"] == ["command_hash:1"]
+    assert kept["health"] == ["0"]
+    # 2.6 KB of bookkeeping leaves room for the most recently used series only
+    assert kept["series"] == ["9"]
+
+def test_get_entry_returns_the_expiry(tmp_path):
+    async def run():
+        store = SQLiteStore(str(tmp_path / "cache.db"), max_bytes=1 << 20)
+        await store.open(compact=False)
+        await store.set("series", 1, b"data", ttl=120)
+        entry = await store.get_entry("series", 1)
+        missing = await store.get_entry("series", 2)
+        await store.close()
+        return entry, missing
+
+    (value, expires_at), missing = asyncio.run(run())
+    assert value == b"data"
+    assert expires_at - time.time() == pytest.approx(120, abs=5)
+    assert missing is None
+
+def test_fetched_values_keep_their_own_ttl():
+    cache = TTLCache("test", ttl=3600)
+
+    async def fetch():
+        return Expiring("stored copy", 30)
+
+    assert asyncio.run(cache.get_or_fetch("key", fetch)) == "stored copy"
+    assert cache.expires_in("key") == pytest.approx(30, abs=1)
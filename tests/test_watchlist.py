@@ -0,0 +1,50 @@
+from datetime import date
+import pytest
+from watchlist import diff_volumes, next_poll_delay, notification_messages, WATCH_MIN_INTERVAL, WATCH_MAX_INTERVAL, WATCH_NEAR_DAYS
+
+TODAY = date(2026, 1, 15)
+
+
+@pytest.mark.parametrize("old, new, expected", [
+    ({}, {"1": ["Volume 1", "2025-10-10", None]},
+     ["New volume: **Volume 1** (2025-10-10 JP)"]),
+    ({"1": ["Volume 1", "2025-10-10", None]}, {"1": ["Volume 1", "2025-10-10", None], "2": ["Volume 2", "2026-02-10", "2026-08-01"]},
+     ["New volume: **Volume 2** (2026-02-10 JP, 2026-08-01 EN)"]),
+    ({"1": ["Volume 1", "2025-10-10", None]}, {"1": ["Volume 1", "2025-10-10", "2026-04-07"]},
+     ["**Volume 1** is getting an EN release on 2026-04-07"]),
+    ({"1": ["Volume 1", "2025-10-10", "2026-04-07"]}, {"1": ["Volume 1", "2025-10-10", "2026-05-05"]},
+     ["**Volume 1** EN release moved from 2026-04-07 to 2026-05-05"]),
+    ({"1": ["Volume 1", "2026-02-10", None]}, {"1": ["Volume 1", "2026-03-10", None]},
+     ["**Volume 1** JP release moved from 2026-02-10 to 2026-03-10"]),
+    ({"1": ["Volume 1", "2025-10-10", "2026-04-07"]}, {"1": ["Volume 1", "2025-10-10", "2026-04-07"]},
+     []),
+    ({}, {"10": ["Volume 10", "2026-01-10", None], "9.5": ["Volume 9.5", "2025-12-10", None]},
+     ["New volume: **Volume 9.5** (2025-12-10 JP)", "New volume: **Volume 10** (2026-01-10 JP)"]),
+], ids=["new volume", "new volume with EN", "new EN release", "EN date moved", "JP date moved", "unchanged", "sorted by volume order"])
+def test_diff_volumes(old, new, expected):
+    assert diff_volumes(old, new) == expected
+
+
+@pytest.mark.parametrize("days_away, expected", [
+    (None, WATCH_MAX_INTERVAL),
+    (-10, WATCH_MIN_INTERVAL),
+    (-4 * WATCH_NEAR_DAYS - 1, WATCH_MAX_INTERVAL),
+    (0, WATCH_MIN_INTERVAL),
+    (WATCH_NEAR_DAYS, WATCH_MIN_INTERVAL),
+    (WATCH_NEAR_DAYS + 4, min(WATCH_MAX_INTERVAL, max(WATCH_MIN_INTERVAL, 4 * 86400 / 4))),
+    (WATCH_NEAR_DAYS + 365, WATCH_MAX_INTERVAL),
+], ids=["no prediction", "overdue", "long overdue", "due today", "near", "a bit further", "far"])
+def test_next_poll_delay(days_away, expected):
+    next_expected = None if days_away is None else TODAY.toordinal() + days_away
+    assert next_poll_delay(next_expected, today=TODAY) == expected
+
+
+@pytest.mark.parametrize("text_length, watchers", [(50, 2), (1900, 20), (300, 400), (2000, 3)])
+def test_notification_messages_keep_every_mention(text_length, watchers):
+    text = "x" * text_length
+    user_ids = [10 ** 17 + i for i in range(watchers)]
+    messages = notification_messages(text, user_ids)
+    assert all(len(message) <= 2000 for message in messages)
+    assert text in messages[0]
+    assert all(f"<@{user_id}>" in "".join(messages) for user_id in user_ids)
+    assert sum(message.count("<@") for message in messages) == watchers
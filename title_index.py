@@ -0,0 +1,191 @@
+import os
+import bisect
+import logging
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass, asdict
+from typing import Optional
+import fast_json
+
+logger = logging.getLogger(__name__)
+
+TITLE_INDEX_ENABLED = os.getenv("TITLE_INDEX_ENABLED", "1") == "1"
+FUZZY_MIN_SCORE = float(os.getenv("TITLE_INDEX_FUZZY_MIN_SCORE", "0.3"))
+FUZZY_MAX_CANDIDATES = int(os.getenv("TITLE_INDEX_FUZZY_MAX_CANDIDATES", "200"))   # entries scored per fuzzy lookup
+
+
+####### Misc Functions #######
+
+def normalize_title(title):
+    return " ".join(unicodedata.normalize("NFKC", title).casefold().split())
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+######## Data Classes ########
+
+@dataclass(slots=True)
+class TitleEntry:
+    id: int
+    lang: str
+    title: Optional[str]
+    romaji: Optional[str] = None
+    title_orig: Optional[str] = None
+    romaji_orig: Optional[str] = None
+
+    @property
+    def licensed(self):
+        return self.lang == "en"
+
+    @property
+    def display_name(self):
+        # Same name the search results show
+        return self.title if self.lang == "en" else (self.romaji_orig or self.title)
+
+    def names(self):
+        return {normalize_title(n) for n in (self.title, self.romaji, self.title_orig, self.romaji_orig) if n}
+
+    @classmethod
+    def from_json(cls, item: dict) -> 'TitleEntry':
+        return cls(
+            id=int(item["id"]),
+            lang=item.get("lang", "ja"),
+            title=item.get("title"),
+            romaji=item.get("romaji"),
+            title_orig=item.get("title_orig"),
+            romaji_orig=item.get("romaji_orig")
+        )
+
+
+class TitleIndex:
+    # Prefix lookups go through a sorted list of every known name, fuzzy lookups through
+    # an inverted index of trigrams. Both are kept up to date as entries come and go
+    def __init__(self):
+        self.entries = {}
+        self.crawl_page = 1
+        self.complete = False
+        self._trigrams = {}
+        self._names = {}
+        self._name_trigrams = {}    # entry id -> trigram set of each of its names
+        self._sorted = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, entry):
+        old = self.entries.get(entry.id)
+        if old == entry:
+            return
+        if old is not None:
+            self._remove(old)
+        self.entries[entry.id] = entry
+        name_trigrams = []
+        for name in entry.names():
+            ids = self._names.get(name)
+            if ids is None:
+                ids = self._names[name] = set()
+                bisect.insort(self._sorted, name)
+            ids.add(entry.id)
+            tris = frozenset(trigrams(name))
+            name_trigrams.append(tris)
+            for tri in tris:
+                self._trigrams.setdefault(tri, set()).add(entry.id)
+        self._name_trigrams[entry.id] = name_trigrams
+
+    def add_many(self, items):
+        for item in items:
+            try:
+                self.add(TitleEntry.from_json(item))
+            except (KeyError, TypeError, ValueError):
+                logger.debug(f"Skipping malformed title index item {item!r}")
+
+    def _remove(self, entry):
+        for name in entry.names():
+            ids = self._names.get(name)
+            if ids is not None:
+                ids.discard(entry.id)
+                if not ids:
+                    del self._names[name]
+                    i = bisect.bisect_left(self._sorted, name)
+                    if i < len(self._sorted) and self._sorted[i] == name:
+                        del self._sorted[i]
+        for tris in self._name_trigrams.pop(entry.id, ()):
+            for tri in tris:
+                ids = self._trigrams.get(tri)
+                if ids is not None:
+                    ids.discard(entry.id)
+                    if not ids:
+                        del self._trigrams[tri]
+
+    def _matches_filter(self, entry, licensed):
+        if licensed == "Licensed":
+            return entry.licensed
+        if licensed == "Unlicensed":
+            return not entry.licensed
+        return True
+
+    def exact(self, query, licensed="Both"):
+        ids = self._names.get(normalize_title(query), ())
+        return [self.entries[i] for i in ids if self._matches_filter(self.entries[i], licensed)]
+
+    def prefix(self, query, limit=25, licensed="Both"):
+        query = normalize_title(query)
+        results = {}
+        i = bisect.bisect_left(self._sorted, query)
+        while i < len(self._sorted) and self._sorted[i].startswith(query) and len(results) < limit:
+            for entry_id in self._names[self._sorted[i]]:
+                entry = self.entries[entry_id]
+                if self._matches_filter(entry, licensed):
+                    results.setdefault(entry_id, entry)
+            i += 1
+        return list(results.values())[:limit]
+
+    def fuzzy(self, query, limit=25, licensed="Both"):
+        query_tris = trigrams(normalize_title(query))
+        if not query_tris:
+            return []
+        shared = Counter()
+        for tri in query_tris:
+            shared.update(self._trigrams.get(tri, ()))
+        # Jaccard >= min score needs at least that fraction of the query's trigrams in common.
+        # Only the entries sharing the most trigrams get scored, so common words can't blow up the work
+        min_shared = FUZZY_MIN_SCORE * len(query_tris)
+        scored = []
+        for entry_id, count in shared.most_common(FUZZY_MAX_CANDIDATES):
+            if count < min_shared:
+                break
+            entry = self.entries[entry_id]
+            if not self._matches_filter(entry, licensed):
+                continue
+            # Best Jaccard similarity against any of the entry's names
+            score = max(len(query_tris & tris) / len(query_tris | tris) for tris in self._name_trigrams[entry_id])
+            if score >= FUZZY_MIN_SCORE:
+                scored.append((score, entry_id))
+        scored.sort(reverse=True)
+        return [self.entries[entry_id] for _, entry_id in scored[:limit]]
+
+    def search(self, query, limit=25, licensed="Both"):
+        results = {e.id: e for e in self.prefix(query, limit, licensed)}
+        if len(results) < limit:
+            for entry in self.fuzzy(query, limit, licensed):
+                results.setdefault(entry.id, entry)
+        return list(results.values())[:limit]
+
+    def dumps(self):
+        return fast_json.dumps({
+            "crawl_page": self.crawl_page,
+            "complete": self.complete,
+            "entries": [asdict(e) for e in self.entries.values()]
+        })
+
+    def loads(self, raw):
+        # Restores the crawl position and returns the saved entries, so they can be added in chunks
+        data = fast_json.loads(raw)
+        self.crawl_page = data.get("crawl_page", 1)
+        self.complete = data.get("complete", False)
+        return [TitleEntry(**item) for item in data.get("entries", [])]
+
+
+title_index = TitleIndex()
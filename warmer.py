@@ -0,0 +1,107 @@
+import os
+import asyncio
+import logging
+from bot_utils import (series_cache, search_cache, series_flight, refresh_series_info, refresh_search_page, search_params, search_page_key,
+                       load_stored_series_info, load_stored_search_page, shortcut_series_id)
+from popularity import series_popularity, query_popularity
+from render_pool import prerender_graph, RendererBusy, RenderTimeout
+from metrics import register_stats
+
+logger = logging.getLogger(__name__)
+
+####### Warmer Settings #######
+
+HOT_WARM_INTERVAL = float(os.getenv("HOT_WARM_INTERVAL", "300"))     # 0 = no warming
+HOT_WARM_TOP_K = int(os.getenv("HOT_WARM_TOP_K", "50"))               # series (and queries) kept warm
+HOT_WARM_API_BUDGET = int(os.getenv("HOT_WARM_API_BUDGET", "20"))     # RanobeDB requests per round
+HOT_WARM_AHEAD = float(os.getenv("HOT_WARM_AHEAD", "900"))            # refresh entries that expire within this many seconds
+HOT_WARM_MIN_SCORE = float(os.getenv("HOT_WARM_MIN_SCORE", "2"))      # decayed lookups before something counts as hot
+HOT_WARM_GRAPHS = os.getenv("HOT_WARM_GRAPHS", "1") == "1"
+
+counters = {
+    "rounds": 0,
+    "series_refreshed": 0,
+    "searches_refreshed": 0,
+    "loaded_from_store": 0,     # already refreshed by another process, so no API request needed
+    "graphs_rendered": 0,
+    "over_budget": 0,           # hot entries left to expire because the round's budget was used up
+    "failures": 0
+}
+register_stats("warmer", "hot", lambda: counters, counters=counters)
+
+
+def needs_refresh(cache, key):
+    expires_in = cache.expires_in(key)
+    return expires_in is None or expires_in < HOT_WARM_AHEAD
+
+async def warm_series(budget):
+    for series_id, score, _ in series_popularity.top(HOT_WARM_TOP_K):
+        if score < HOT_WARM_MIN_SCORE:
+            break
+        info = series_cache.get(series_id)
+        if needs_refresh(series_cache, series_id) and not series_flight.in_flight(series_id):
+            # In cluster mode every process warms the series its own shards look up, and those overlap
+            stored = await load_stored_series_info(series_id, HOT_WARM_AHEAD)
+            if stored is not None:
+                info = stored
+                counters["loaded_from_store"] += 1
+            elif budget <= 0:
+                counters["over_budget"] += 1
+                continue
+            else:
+                budget -= 1
+                try:
+                    info = await refresh_series_info(series_id)
+                    counters["series_refreshed"] += 1
+                except Exception:
+                    counters["failures"] += 1
+                    logger.warning(f"Warming series {series_id} failed", exc_info=True)
+                    continue
+        if HOT_WARM_GRAPHS and info is not None:
+            _, *graph_args = info
+            try:
+                if await prerender_graph(*graph_args):
+                    counters["graphs_rendered"] += 1
+            except (RendererBusy, RenderTimeout):
+                pass
+            except Exception:
+                counters["failures"] += 1
+                logger.warning(f"Pre-rendering the graph of series {series_id} failed", exc_info=True)
+    return budget
+
+async def warm_searches(budget):
+    for _, score, (title, sort, licensed) in query_popularity.top(HOT_WARM_TOP_K):
+        if score < HOT_WARM_MIN_SCORE:
+            break
+        # These never reach the search endpoint, and the series they resolve to is tracked on its own
+        if shortcut_series_id(title, licensed) is not None:
+            continue
+        params = search_params(title, sort, licensed)
+        if not needs_refresh(search_cache, search_page_key(1, params)):
+            continue
+        if await load_stored_search_page(1, params, HOT_WARM_AHEAD) is not None:
+            counters["loaded_from_store"] += 1
+            continue
+        if budget <= 0:
+            counters["over_budget"] += 1
+            continue
+        budget -= 1
+        try:
+            await refresh_search_page(1, params)
+            counters["searches_refreshed"] += 1
+        except Exception:
+            counters["failures"] += 1
+            logger.warning(f"Warming the search for '{title}' failed", exc_info=True)
+    return budget
+
+async def hot_warm_loop(interval=HOT_WARM_INTERVAL):
+    # Keeps the most looked up series (and their graphs) and searches cached, so they don't
+    # expire between lookups. Series go first since they're what most lookups end up at
+    while True:
+        await asyncio.sleep(interval)
+        counters["rounds"] += 1
+        try:
+            budget = await warm_series(HOT_WARM_API_BUDGET)
+            await warm_searches(budget)
+        except Exception:
+            logger.warning("Warming hot series failed", exc_info=True)
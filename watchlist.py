@@ -0,0 +1,325 @@
+import os
+import time
+import asyncio
+import logging
+import aiohttp
+import discord
+from datetime import date
+import fast_json
+from bot_utils import Series, fetch_series_json, series_info, resolve_series_id, series_cache
+from store import cache_store
+from metrics import register_stats
+
+logger = logging.getLogger(__name__)
+
+####### Watchlist Settings #######
+
+WATCH_MIN_INTERVAL = float(os.getenv("WATCH_MIN_INTERVAL", "21600"))     # a series is never polled more often than this
+WATCH_MAX_INTERVAL = float(os.getenv("WATCH_MAX_INTERVAL", "172800"))    # or less often than this
+WATCH_NEAR_DAYS = int(os.getenv("WATCH_NEAR_DAYS", "30"))                # poll as often as allowed this close to a predicted release
+WATCH_POLL_TICK = float(os.getenv("WATCH_POLL_TICK", "60"))
+WATCH_POLL_BATCH = int(os.getenv("WATCH_POLL_BATCH", "10"))              # series polled per tick, at most
+WATCH_MAX_PER_USER = int(os.getenv("WATCH_MAX_PER_USER", "25"))
+
+RANOBEDB_SERIES_URL = "https://ranobedb.org/series/"
+MESSAGE_LIMIT = 2000
+
+WATCH_SCHEMA = """
+CREATE TABLE IF NOT EXISTS watches (
+    series_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (series_id, channel_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS watches_user ON watches (user_id, channel_id);
+CREATE TABLE IF NOT EXISTS watched_series (
+    series_id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    volumes BLOB NOT NULL,
+    next_expected INTEGER,
+    next_poll REAL NOT NULL,
+    last_polled REAL
+);
+CREATE INDEX IF NOT EXISTS watched_series_due ON watched_series (next_poll);
+"""
+
+counters = {
+    "polls": 0,
+    "poll_errors": 0,
+    "changes": 0,
+    "notifications": 0,
+    "notification_errors": 0,
+    "dropped_channels": 0
+}
+watchlist_stats = {"series": 0, "watches": 0, "channels": 0}
+register_stats("watchlist", "polling", lambda: counters, counters=counters)
+register_stats("watchlist", "store", lambda: watchlist_stats)
+
+
+####### Store Queries #######
+# These run on the store thread, through cache_store.run
+
+def _create_tables(conn):
+    conn.executescript(WATCH_SCHEMA)
+
+def _add_watch(conn, series_id, title, volumes, next_expected, next_poll, channel_id, user_id):
+    conn.execute(
+        "INSERT OR IGNORE INTO watched_series (series_id, title, volumes, next_expected, next_poll, last_polled) VALUES (?, ?, ?, ?, ?, ?)",
+        (series_id, title, volumes, next_expected, next_poll, time.time())
+    )
+    return _insert_watch(conn, series_id, channel_id, user_id)
+
+def _subscribe(conn, series_id, channel_id, user_id):
+    # Watches a series that is already being polled: (title, next_expected, added), or None if it isn't
+    row = conn.execute("SELECT title, next_expected FROM watched_series WHERE series_id = ?", (series_id,)).fetchone()
+    if row is None:
+        return None
+    return (*row, _insert_watch(conn, series_id, channel_id, user_id))
+
+def _insert_watch(conn, series_id, channel_id, user_id):
+    return conn.execute(
+        "INSERT OR IGNORE INTO watches (series_id, channel_id, user_id, created_at) VALUES (?, ?, ?, ?)",
+        (series_id, channel_id, user_id, time.time())
+    ).rowcount > 0
+
+def _remove_watch(conn, series_id, channel_id, user_id):
+    removed = conn.execute(
+        "DELETE FROM watches WHERE series_id = ? AND channel_id = ? AND user_id = ?", (series_id, channel_id, user_id)
+    ).rowcount > 0
+    _drop_unwatched(conn)
+    return removed
+
+def _remove_channel(conn, channel_id):
+    removed = conn.execute("DELETE FROM watches WHERE channel_id = ?", (channel_id,)).rowcount
+    _drop_unwatched(conn)
+    return removed
+
+def _drop_unwatched(conn):
+    conn.execute("DELETE FROM watched_series WHERE series_id NOT IN (SELECT series_id FROM watches)")
+
+def _user_watches(conn, user_id, channel_id):
+    return conn.execute(
+        """SELECT s.series_id, s.title FROM watches w JOIN watched_series s ON s.series_id = w.series_id
+           WHERE w.user_id = ? AND w.channel_id = ? ORDER BY s.title""",
+        (user_id, channel_id)
+    ).fetchall()
+
+def _count_user_watches(conn, user_id):
+    return conn.execute("SELECT COUNT(*) FROM watches WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+def _due_series(conn, now, limit):
+    # The series whose next release is predicted soonest go first. Without a prediction they go last
+    return conn.execute(
+        """SELECT series_id, volumes FROM watched_series WHERE next_poll <= ?
+           ORDER BY next_expected IS NULL, next_expected, next_poll LIMIT ?""",
+        (now, limit)
+    ).fetchall()
+
+def _update_series(conn, series_id, title, volumes, next_expected, next_poll):
+    conn.execute(
+        "UPDATE watched_series SET title = ?, volumes = ?, next_expected = ?, next_poll = ?, last_polled = ? WHERE series_id = ?",
+        (title, volumes, next_expected, next_poll, time.time(), series_id)
+    )
+
+def _postpone(conn, series_id, next_poll):
+    conn.execute("UPDATE watched_series SET next_poll = ? WHERE series_id = ?", (next_poll, series_id))
+
+def _subscribers(conn, series_id):
+    return conn.execute("SELECT channel_id, user_id FROM watches WHERE series_id = ? ORDER BY created_at", (series_id,)).fetchall()
+
+def _stats(conn):
+    series, = conn.execute("SELECT COUNT(*) FROM watched_series").fetchone()
+    watches, channels = conn.execute("SELECT COUNT(*), COUNT(DISTINCT channel_id) FROM watches").fetchone()
+    return {"series": series, "watches": watches, "channels": channels}
+
+
+####### Volume Diffs #######
+
+def volume_snapshot(series):
+    # sort_order -> [title, JP date, EN date], as stored between polls
+    return {
+        str(vol.sort_order): [vol.title_en or vol.title_jp, str(vol.jp_release_date), str(vol.en_release_date) if vol.en_release_date else None]
+        for vol in series.volumes
+    }
+
+def diff_volumes(old, new):
+    changes = []
+    for order, (title, jp, en) in sorted(new.items(), key=lambda item: float(item[0])):
+        before = old.get(order)
+        if before is None:
+            changes.append(f"New volume: **{title}** ({jp} JP" + (f", {en} EN)" if en else ")"))
+            continue
+        _, old_jp, old_en = before
+        if jp != old_jp:
+            changes.append(f"**{title}** JP release moved from {old_jp} to {jp}")
+        if en and not old_en:
+            changes.append(f"**{title}** is getting an EN release on {en}")
+        elif en and en != old_en:
+            changes.append(f"**{title}** EN release moved from {old_en} to {en}")
+    return changes
+
+def predicted_release(stats, series):
+    # The earliest predicted JP or EN release, as a date ordinal. EN only counts while it's catching up with JP
+    candidates = []
+    if series.publication_status == "ongoing" and stats.jp.next_expected is not None:
+        candidates.append(stats.jp.next_expected)
+    if series.licensed and stats.en.volumes < stats.jp.volumes and stats.en.next_expected is not None:
+        candidates.append(stats.en.next_expected)
+    return min(candidates) if candidates else None
+
+def next_poll_delay(next_expected, today=None):
+    # As often as allowed around a predicted release (announcements show up before it), rarely when it's far off.
+    # Long overdue series are probably on hiatus, so they're treated like ones without a prediction
+    if next_expected is None:
+        return WATCH_MAX_INTERVAL
+    days_away = next_expected - (today or date.today()).toordinal()
+    if -4 * WATCH_NEAR_DAYS <= days_away <= WATCH_NEAR_DAYS:
+        return WATCH_MIN_INTERVAL
+    if days_away < 0:
+        return WATCH_MAX_INTERVAL
+    return min(WATCH_MAX_INTERVAL, max(WATCH_MIN_INTERVAL, (days_away - WATCH_NEAR_DAYS) * 86400 / 4))
+
+def parse_series(data):
+    series = Series.from_json(data)
+    info = series_info(series)
+    series_cache.set(series.id, info)
+    next_expected = predicted_release(info[-1], series)
+    return series, info, next_expected
+
+
+####### Commands #######
+
+async def open_watchlist():
+    if cache_store is not None:
+        await cache_store.run(_create_tables)
+        watchlist_stats.update(await cache_store.run(_stats))
+
+async def watch_series(query, channel_id, user_id):
+    if cache_store is None:
+        return "Watching series needs the cache database, which is turned off."
+    if await cache_store.run(_count_user_watches, user_id) >= WATCH_MAX_PER_USER:
+        return f"You can watch up to {WATCH_MAX_PER_USER} series. Use /unwatch to make room."
+    series_id = await resolve_series_id(query)
+    if series_id is None:
+        return f"No series found for '{query}'."
+    # A series somebody already watches has a snapshot and gets polled, so there's nothing to fetch
+    watched = await cache_store.run(_subscribe, series_id, channel_id, user_id)
+    if watched is not None:
+        title, next_expected, added = watched
+    else:
+        title, next_expected, added = await _watch_new_series(series_id, channel_id, user_id)
+        if title is None:
+            return f"No series found for '{query}'."
+    if not added:
+        return f"You're already watching **{title}** in this channel."
+    message = f"Watching **{title}** in this channel. You'll be pinged here when a new volume or release date shows up."
+    if next_expected is not None:
+        message += f"\nNext release expected around {date.fromordinal(max(next_expected, date.today().toordinal()))}."
+    return message
+
+async def _watch_new_series(series_id, channel_id, user_id):
+    # The first snapshot is what later polls get diffed against, so it has to be current and not a cached copy
+    try:
+        data = await fetch_series_json(series_id, use_store=False)
+    except aiohttp.ClientResponseError as e:
+        # Ids are taken as they are, so this is where a made up one turns up
+        if e.status == 404:
+            return None, None, False
+        raise
+    series, _, next_expected = parse_series(data)
+    volumes = fast_json.dumps(volume_snapshot(series))
+    added = await cache_store.run(_add_watch, series.id, series.title, volumes, next_expected,
+                                  time.time() + next_poll_delay(next_expected), channel_id, user_id)
+    return series.title, next_expected, added
+
+async def unwatch_series(query, channel_id, user_id):
+    if cache_store is None:
+        return "Watching series needs the cache database, which is turned off."
+    series_id = await resolve_series_id(query)
+    if series_id is None:
+        return f"No series found for '{query}'."
+    if await cache_store.run(_remove_watch, series_id, channel_id, user_id):
+        return "Stopped watching it in this channel."
+    return "You aren't watching that series in this channel."
+
+async def watched_autocomplete(ctx: discord.AutocompleteContext):
+    # The user's watches in this channel, with the series id as the value
+    if cache_store is None:
+        return []
+    rows = await cache_store.run(_user_watches, ctx.interaction.user.id, ctx.interaction.channel_id)
+    value = ctx.value.casefold()
+    return [discord.OptionChoice(title[:100], str(series_id)) for series_id, title in rows if value in title.casefold()][:25]
+
+
+####### Polling #######
+
+async def poll_series(bot, series_id, volumes):
+    counters["polls"] += 1
+    try:
+        series, _, next_expected = parse_series(await fetch_series_json(series_id, use_store=False))
+    except Exception:
+        counters["poll_errors"] += 1
+        logger.warning(f"Polling watched series {series_id} failed", exc_info=True)
+        await cache_store.run(_postpone, series_id, time.time() + WATCH_MIN_INTERVAL)
+        return
+    snapshot = volume_snapshot(series)
+    changes = diff_volumes(fast_json.loads(volumes), snapshot)
+    await cache_store.run(_update_series, series_id, series.title, fast_json.dumps(snapshot), next_expected,
+                          time.time() + next_poll_delay(next_expected))
+    if changes:
+        counters["changes"] += len(changes)
+        await notify(bot, series_id, series.title, changes)
+
+def notification_messages(text, user_ids, limit=MESSAGE_LIMIT):
+    # The text with as many mentions in front of it as fit, then the rest of the mentions in as few messages as possible
+    text = text[:limit]
+    groups = [[]]
+    room = limit - len(text) - 1
+    for user_id in user_ids:
+        mention = f"<@{user_id}>"
+        needed = len(mention) + (1 if groups[-1] else 0)
+        if needed > room:
+            groups.append([])
+            room = limit
+            needed = len(mention)
+        groups[-1].append(mention)
+        room -= needed
+    first, *rest = groups
+    return [f"{' '.join(first)}\n{text}" if first else text] + [" ".join(group) for group in rest]
+
+async def notify(bot, series_id, title, changes):
+    # One message per channel, pinging everyone there who watches the series
+    by_channel = {}
+    for channel_id, user_id in await cache_store.run(_subscribers, series_id):
+        by_channel.setdefault(channel_id, []).append(user_id)
+    lines = [f"📚 **{title}** ({RANOBEDB_SERIES_URL}{series_id})"] + [f"- {change}" for change in changes[:10]]
+    if len(changes) > 10:
+        lines.append(f"...and {len(changes) - 10} more")
+    text = "\n".join(lines)
+    allowed_mentions = discord.AllowedMentions(everyone=False, roles=False, users=True)
+    for channel_id, user_ids in by_channel.items():
+        channel = bot.get_partial_messageable(channel_id)
+        try:
+            for content in notification_messages(text, user_ids):
+                await channel.send(content, allowed_mentions=allowed_mentions)
+            counters["notifications"] += 1
+        except (discord.Forbidden, discord.NotFound):
+            # The channel is gone or we can't post there anymore, so nobody would see these
+            counters["dropped_channels"] += 1
+            await cache_store.run(_remove_channel, channel_id)
+            logger.info(f"Dropped the watches of channel {channel_id}, which can't be posted to")
+        except discord.HTTPException:
+            counters["notification_errors"] += 1
+            logger.warning(f"Sending a watch notification to channel {channel_id} failed", exc_info=True)
+
+async def watch_poll_loop(bot, tick=WATCH_POLL_TICK):
+    # Every watched series is polled once, however many channels watch it, in order of its predicted release
+    while True:
+        await asyncio.sleep(tick)
+        try:
+            due = await cache_store.run(_due_series, time.time(), WATCH_POLL_BATCH)
+            await asyncio.gather(*(poll_series(bot, series_id, volumes) for series_id, volumes in due))
+            watchlist_stats.update(await cache_store.run(_stats))
+        except Exception:
+            logger.warning("Polling watched series failed", exc_info=True)